@@ -0,0 +1,246 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import main
+
+WORDS = (
+    "the movie was great and i loved every minute of it but ending slow acting "
+    "story plot season episode dvd blu-ray picture sound quality recommend "
+    "family kids watch again characters boring classic funny series price"
+).split()
+FORMATS = [" DVD", " Blu-ray", " Amazon Video", " Prime Video", " VHS Tape"]
+NAMES = ["John", "Mary", "A. Reader", "Movie Fan", "Kindle Customer", "J. Smith"]
+
+
+#one Movies_and_TV-shaped review; the same seed and index always give the same record
+def synthetic_review(rng, index, modified=False):
+    unix_time = 946684800 + rng.randrange(600_000_000)
+    words = rng.randrange(5, 150)
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    if rng.random() < 0.05:
+        text += " <br />café Ｆｕｌｌ"
+    record = {
+        "overall": float(rng.randint(1, 5)),
+        "verified": rng.random() < 0.8,
+        "reviewTime": time.strftime("%m %d, %Y", time.gmtime(unix_time)),
+        "reviewerID": f"A{rng.randrange(36 ** 8):012X}",
+        "asin": f"B{rng.randrange(10 ** 9):09d}",
+        "style": {"Format:": rng.choice(FORMATS)},
+        "reviewerName": rng.choice(NAMES),
+        "reviewText": text,
+        "summary": " ".join(rng.choice(WORDS) for _ in range(rng.randrange(1, 6))).title(),
+        "unixReviewTime": unix_time,
+    }
+    if rng.random() < 0.1:
+        record["vote"] = str(rng.randint(2, 200))
+    if rng.random() < 0.001:
+        del record["reviewerID"]
+    if modified:
+        record["reviewText"] = "THIS REVIEW HAS BEEN MODIFIED! " + str(index)
+    return record
+
+
+#stream a seeded dataset to disk in constant memory; records whose index is
+#in `modified` get their text replaced, which gives a tampered twin of the
+#same dataset for the diff scenario
+def generate_dataset(path, records, seed=0, modified=()):
+    modified = set(modified)
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        batch = []
+        for index in range(records):
+            batch.append(json.dumps(synthetic_review(rng, index, index in modified)))
+            if len(batch) == 10_000:
+                f.write("\n".join(batch) + "\n")
+                batch = []
+        if batch:
+            f.write("\n".join(batch) + "\n")
+    return path
+
+
+#run fn warmup + repeat times and summarise the timed runs
+def time_scenario(fn, repeat, warmup, ops=1, setup=None):
+    runs = []
+    for i in range(warmup + repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            runs.append(elapsed)
+    median = statistics.median(runs)
+    return {
+        "median_s": median,
+        "min_s": min(runs),
+        "mean_s": statistics.fmean(runs),
+        "runs": runs,
+        "ops": ops,
+        "ops_per_sec": ops / median if median else 0.0,
+    }
+
+
+def run_benchmarks(records, seed=0, repeat=5, warmup=1, proofs=1000, changes=100, workdir=None, mode="hex"):
+    rng = random.Random(seed)
+    changed = sorted(rng.sample(range(records), min(changes, records)))
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        original = generate_dataset(os.path.join(tmp, "original.json"), records, seed)
+        tampered = generate_dataset(os.path.join(tmp, "tampered.json"), records, seed, changed)
+        size_mb = os.path.getsize(original) / (1024 * 1024)
+#the pipeline prints progress; keep benchmark output clean
+        quiet = contextlib.redirect_stdout(io.StringIO())
+        results = {}
+        with quiet:
+#a third of the changes each as modifications, deletions and insertions
+            shifted = os.path.join(tmp, "shifted.json")
+            third = max(1, len(changed) // 3)
+            manifest = main.tamper_stream(original, shifted, third, third, third, seed=seed, total=records)
+            leaves = main.build_leaf_hashes(original, limit=records, packed=True, mode=mode)
+            tree = main.build_merkle_tree(bytearray(leaves), verbose=False, mode=mode)
+            tampered_tree = main.build_merkle_tree(
+                main.build_leaf_hashes(tampered, limit=records, packed=True, mode=mode), verbose=False, mode=mode
+            )
+
+            results["leaf_hashing"] = time_scenario(
+                lambda: main.build_leaf_hashes(original, limit=records, packed=True, mode=mode),
+                repeat, warmup, ops=records
+            )
+            results["tree_build"] = time_scenario(
+                lambda: main.build_merkle_tree(bytearray(leaves), verbose=False, mode=mode),
+                repeat, warmup, ops=records
+            )
+
+            indices = [rng.randrange(records) for _ in range(proofs)]
+            results["proof"] = time_scenario(
+                lambda: [tree.proof(i) for i in indices], repeat, warmup, ops=proofs
+            )
+            items = [(tree.leaf(i), tree.proof(i)) for i in indices]
+            results["verify"] = time_scenario(
+                lambda: main.verify_proofs_batch(items, tree.root, mode), repeat, warmup, ops=proofs
+            )
+
+            results["diff"] = time_scenario(
+                lambda: main.diff_trees(tree, tampered_tree), repeat, warmup, ops=len(changed)
+            )
+            found = main.diff_trees(tree, tampered_tree)
+
+            results["align"] = time_scenario(
+                lambda: main.align_records(original, shifted, records + third, mode), repeat, warmup, ops=records
+            )
+            detection = main.score_detection(
+                manifest, main.align_records(original, shifted, records + third, mode)
+            )
+
+            updates = [(i, tampered_tree.node(0, i)) for i in changed]
+            originals = [(i, tree.node(0, i)) for i in changed]
+            results["update"] = time_scenario(
+                lambda: tree.update_leaves(updates), repeat, warmup, ops=len(updates),
+                setup=lambda: tree.update_leaves(originals)
+            )
+    return {
+        "meta": {
+            "records": records,
+            "seed": seed,
+            "mode": mode,
+            "repeat": repeat,
+            "warmup": warmup,
+            "proofs": proofs,
+            "changes": len(changed),
+            "dataset_mb": round(size_mb, 2),
+            "diff_correct": found == changed,
+            "align_correct": detection["exact"],
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+
+
+#scenarios whose median got slower than the baseline by more than threshold
+def compare_to_baseline(report, baseline, threshold=0.10):
+    regressions = []
+    if baseline["meta"].get("records") != report["meta"]["records"]:
+        print("Warning: baseline was recorded with a different dataset size.")
+    if baseline["meta"].get("mode", "hex") != report["meta"]["mode"]:
+        print("Warning: baseline was recorded with a different hash mode.")
+    for name, result in report["results"].items():
+        previous = baseline["results"].get(name)
+        if not previous:
+            continue
+        ratio = result["median_s"] / previous["median_s"] if previous["median_s"] else 1.0
+        result["baseline_median_s"] = previous["median_s"]
+        result["change"] = ratio - 1
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def print_report(report):
+    meta = report["meta"]
+    print(f"\nBENCHMARK: {meta['records']:,} records ({meta['dataset_mb']} MB), "
+          f"{meta['repeat']} runs after {meta['warmup']} warmup, {meta.get('mode', 'hex')} mode")
+    for name, result in report["results"].items():
+        line = f"{name:<14}{result['median_s'] * 1000:>12.3f} ms  {result['ops_per_sec']:>14,.0f} ops/sec"
+        if "change" in result:
+            line += f"  {result['change'] * 100:+.1f}% vs baseline"
+        print(line)
+    if not meta["diff_correct"]:
+        print("Warning: diff scenario did not find exactly the changed records.")
+    if not meta.get("align_correct", True):
+        print("Warning: align scenario did not find exactly the tampered records.")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Merkle tree benchmark suite on synthetic data")
+    parser.add_argument("--records", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--proofs", type=int, default=1000)
+    parser.add_argument("--changes", type=int, default=100)
+    parser.add_argument("--out", default="bench_results.json", help="where to write JSON results")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown fraction that counts as a regression")
+    parser.add_argument("--workdir", help="directory for the generated datasets")
+    parser.add_argument("--mode", default="hex",
+                        help='hash mode: "hex", "raw", or a backend such as "blake2b-16" (see main.HashBackend)')
+    parser.add_argument("--generate-only", metavar="PATH",
+                        help="just write a synthetic dataset of --records to PATH")
+    args = parser.parse_args(argv)
+
+    if args.generate_only:
+        generate_dataset(args.generate_only, args.records, args.seed)
+        print(f"Wrote {args.records:,} synthetic reviews to {args.generate_only}")
+        return 0
+
+    report = run_benchmarks(args.records, args.seed, args.repeat, args.warmup,
+                            args.proofs, args.changes, args.workdir, args.mode)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_to_baseline(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nResults written to {args.out}")
+    if regressions:
+        print("REGRESSIONS:", ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
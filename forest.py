@@ -0,0 +1,217 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import main
+
+#per-shard builds read every record of their file
+ALL_RECORDS = 1 << 62
+MANIFEST = "forest.json"
+
+
+#tree file a shard is saved to inside the forest directory
+def shard_tree_file(directory, number, path):
+    name = os.path.basename(path).split(".")[0]
+    return os.path.join(directory, f"shard_{number:04d}_{name}.bin")
+
+
+#worker: hash one shard file and save its tree. returns the shard entry for
+#the manifest. the shard's own progress output is dropped so parallel
+#builds do not interleave
+def build_shard(path, tree_file, mode="hex", limit=ALL_RECORDS):
+    start = time.perf_counter()
+    progress = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        leaves = main.build_leaf_hashes(path, limit, packed=True, progress=progress, mode=mode)
+        tree = main.build_merkle_tree(leaves, verbose=False, mode=mode)
+        tree.metadata.update(source_offset=progress["offset"], source_lines=progress["lines"])
+        main.save_tree(tree, tree_file, source_path=path)
+    return {"path": path, "tree": tree_file, "root": tree.root, "leaf_count": tree.leaf_count,
+            "seconds": time.perf_counter() - start}
+
+
+#worker: rehash a shard file and compare with the root in the manifest.
+#quick only compares the file's size and mtime with the saved tree
+def check_shard(shard, quick=False):
+    if quick:
+        tree = main.load_tree(shard["tree"])
+        matches = main.tree_matches_source(tree, shard["path"])
+        return {"path": shard["path"], "ok": matches, "root": shard["root"] if matches else None}
+    with contextlib.redirect_stdout(io.StringIO()):
+        mode = shard.get("mode", "hex")
+        leaves = main.build_leaf_hashes(shard["path"], ALL_RECORDS, packed=True, mode=mode)
+        root = main.build_merkle_root(leaves, mode=mode)
+    return {"path": shard["path"], "ok": root == shard["root"], "root": root}
+
+
+#one Merkle tree per shard file and a small top tree over the shard roots.
+#shard trees are saved tree files, mapped only when a proof needs them
+class MerkleForest:
+    def __init__(self, directory, shards, mode="hex"):
+        self.directory = directory
+        self.shards = shards
+        self.mode = mode
+        self.trees = {}
+        self.top = main.build_merkle_tree(
+            bytearray(b"".join(bytes.fromhex(s["root"]) for s in shards)), verbose=False, mode=mode
+        )
+
+    @property
+    def root(self):
+        return self.top.root
+
+    @property
+    def leaf_count(self):
+        return sum(s["leaf_count"] for s in self.shards)
+
+    def shard_number(self, shard):
+        if isinstance(shard, int):
+            return shard
+        for number, entry in enumerate(self.shards):
+            if entry["path"] == shard or os.path.basename(entry["path"]) == shard:
+                return number
+        raise KeyError(f"no shard {shard!r} in the forest")
+
+    def tree(self, shard):
+        number = self.shard_number(shard)
+        if number not in self.trees:
+            self.trees[number] = main.load_tree(self.shards[number]["tree"])
+        return self.trees[number]
+
+#leaf proof inside its shard, chained to the shard root's proof in the top tree
+    def proof(self, shard, index):
+        number = self.shard_number(shard)
+        tree = self.tree(number)
+        return {
+            "shard": number,
+            "index": index,
+            "leaf": tree.leaf(index),
+            "shard_root": tree.root,
+            "shard_proof": tree.proof(index),
+            "top_proof": self.top.proof(number),
+            "root": self.root,
+            "mode": self.mode,
+        }
+
+#rebuild one shard after its file changed; only that shard and the path
+#from its leaf in the top tree are rehashed. a shard that grew is extended
+#with append_to_tree instead of rebuilt, once its old bytes are checked
+#against the full checksum: this is the path for any change, so an edit
+#in the middle of the shard must not pass for an append
+    def update_shard(self, shard):
+        number = self.shard_number(shard)
+        entry = self.shards[number]
+        self.trees.pop(number, None)
+        tree = main.load_tree(entry["tree"])
+        try:
+            if os.path.getsize(entry["path"]) <= tree.metadata["source_size"]:
+                raise ValueError(f"{entry['path']} did not grow")
+            with contextlib.redirect_stdout(io.StringIO()):
+                main.append_to_tree(tree, entry["path"], verify_prefix=True, old_root=entry["root"])
+                main.save_tree(tree, entry["tree"], source_path=entry["path"], checksum=False)
+            entry.update(root=tree.root, leaf_count=tree.leaf_count)
+        except ValueError:
+            entry.update(build_shard(entry["path"], entry["tree"], self.mode))
+        self.top.update_leaf(number, entry["root"])
+        self.save()
+        return self.root
+
+    def save(self):
+        manifest = {"mode": self.mode, "root": self.root, "shards": self.shards}
+        tmp = os.path.join(self.directory, MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.directory, MANIFEST))
+
+
+#build every shard tree in a process pool, one shard per task
+def build_forest(paths, directory="forest", mode="hex", workers=None):
+    os.makedirs(directory, exist_ok=True)
+    print(f"\nBuilding {len(paths)} shard trees...")
+    start = time.perf_counter()
+    tree_files = [shard_tree_file(directory, n, path) for n, path in enumerate(paths)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        shards = list(pool.map(build_shard, paths, tree_files, [mode] * len(paths)))
+    for shard in shards:
+        print(f"{shard['path']}: {shard['leaf_count']:,} leaves in {shard['seconds']:.2f} sec")
+        del shard["seconds"]
+    forest = MerkleForest(directory, shards, mode)
+    forest.save()
+    print(f"Forest of {forest.leaf_count:,} leaves built in {time.perf_counter() - start:.2f} sec")
+    print("FOREST ROOT:", forest.root)
+    return forest
+
+
+def load_forest(directory="forest"):
+    with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    forest = MerkleForest(directory, manifest["shards"], manifest["mode"])
+    if forest.root != manifest["root"]:
+        raise ValueError("forest manifest root does not match its shard roots")
+    return forest
+
+
+#rehash every shard in parallel; returns the shards whose root changed
+def verify_forest(forest, workers=None, quick=False):
+    print(f"\nVerifying {len(forest.shards)} shards...")
+    shards = [dict(shard, mode=forest.mode) for shard in forest.shards]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(check_shard, shards, [quick] * len(shards)))
+    changed = []
+    for number, result in enumerate(results):
+        print(f"{result['path']}: {'OK' if result['ok'] else 'CHANGED'}")
+        if not result["ok"]:
+            changed.append(number)
+    print("Forest intact." if not changed else f"{len(changed)} shard(s) changed.")
+    return changed
+
+
+#a leaf proof rebuilds its shard root, which the top proof takes to the forest root
+def verify_forest_proof(leaf, proof, forest_root):
+    mode = proof.get("mode", "hex")
+    shard_root = main.compute_proof_root(leaf, proof["shard_proof"], mode).hex()
+    return main.compute_proof_root(shard_root, proof["top_proof"], mode).hex() == forest_root
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Merkle forest over several dataset files")
+    parser.add_argument("--dir", default="forest", help="directory for shard trees and the manifest")
+    parser.add_argument("--workers", type=int, help="processes for building and verifying shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build one tree per shard file")
+    build.add_argument("paths", nargs="+")
+    build.add_argument("--mode", default="hex", help='"hex", "raw" or a backend such as "blake2b-16"')
+    verify = commands.add_parser("verify", help="rehash every shard and compare roots")
+    verify.add_argument("--quick", action="store_true", help="only compare file size and mtime")
+    proof = commands.add_parser("proof", help="print and check a chained proof")
+    proof.add_argument("shard", help="shard number or file name")
+    proof.add_argument("index", type=int)
+    update = commands.add_parser("update", help="rehash one changed shard and the top tree")
+    update.add_argument("shard")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        build_forest(args.paths, args.dir, args.mode, args.workers)
+        return 0
+    forest = load_forest(args.dir)
+    if args.command == "verify":
+        return 1 if verify_forest(forest, args.workers, args.quick) else 0
+    if args.command == "proof":
+        shard = int(args.shard) if args.shard.isdigit() else args.shard
+        result = forest.proof(shard, args.index)
+        print(json.dumps(result, indent=2))
+        valid = verify_forest_proof(result["leaf"], result, forest.root)
+        print("Proof Valid:", valid)
+        return 0 if valid else 1
+    shard = int(args.shard) if args.shard.isdigit() else args.shard
+    print("New Forest Root:", forest.update_shard(shard))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -6,85 +6,613 @@ import tracemalloc
 import unicodedata
 import re
 import uuid
+import binascii
+import functools
+import os
+import itertools
+import array
+import collections
+import gzip
+import bz2
+import lzma
+import queue
+import random
+import threading
+import mmap
+import struct
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from metrics import METRICS, Metrics
+
+#size of one raw sha256 digest in packed layers; other hash modes use their
+#backend's digest_size
+DIGEST_SIZE = 32
+#bumped whenever the text a leaf hash is computed from changes
+#1: records without an id got a random uuid4, so their leaves changed every run
+#2: records without an id get a stable key from their content and line number
+LEAF_ENCODING_VERSION = 2
+
+#binary tree file: fixed header, then every layer from the leaves up
+TREE_MAGIC = b"MRKLTREE"
+TREE_FORMAT_VERSION = 4
+#magic, format version, leaf encoding version, hash algorithm, node mode,
+#leaf count, source size, source mtime (ns), source sha256, then (version 2)
+#the byte offset and line count the leaf build stopped at, 0 when unknown,
+#(version 3) a digest of the source's first and last MiB, see source_ends_digest,
+#and (version 4) how many leading source bytes the sha256 covers
+TREE_HEADER = struct.Struct("<8sHH16s8sQQq32sQQ16sQ")
+TREE_HEADER_SIZE = 256
+#versions 1 to 3 padded the header to 128 bytes
+LEGACY_TREE_HEADER_SIZE = 128
+#record offset index saved next to the tree: magic, leaf count, source size,
+#source mtime (ns), then one little-endian uint64 line offset per leaf
+INDEX_MAGIC = b"MRKLIDX1"
+INDEX_HEADER = struct.Struct("<8sQQq")
 
 #sha256 hash function
 def sha256_hash(text):
     return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+#hash backends, picked by the same `mode` string that is passed to every
+#hashing function. "hex" and "raw" are the original SHA-256 trees: a leaf is
+#sha256 of its text and a node hashes its children's hex text ("hex") or raw
+#bytes ("raw"), without prefixes. any other mode names a hashlib algorithm,
+#with an optional digest size in bytes for BLAKE2 ("blake2b-16", "blake2s"),
+#and hashes leaves as 0x00 + text and nodes as 0x01 + children so a leaf
+#digest can never be passed off as an inner node
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+HASH_BACKENDS = {}
+
+class HashBackend:
+    def __init__(self, mode="hex"):
+        self.mode = mode
+        if mode in ("hex", "raw"):
+            self.algorithm = "sha256"
+            self.new = hashlib.sha256
+            self.leaf_prefix = self.node_prefix = b""
+        else:
+            name, _, size = mode.partition("-")
+            if name not in hashlib.algorithms_available or name.startswith("shake"):
+                raise ValueError(f"unknown hash mode {mode!r}")
+            if size and not name.startswith("blake2"):
+                raise ValueError(f"only BLAKE2 modes take a digest size, not {mode!r}")
+            constructor = getattr(hashlib, name, None) or functools.partial(hashlib.new, name)
+            self.new = functools.partial(constructor, digest_size=int(size)) if size else constructor
+            self.algorithm = mode
+            self.leaf_prefix = LEAF_PREFIX
+            self.node_prefix = NODE_PREFIX
+#also rejects a BLAKE2 digest size out of range
+        self.digest_size = self.new().digest_size
+        self.hex_nodes = mode == "hex"
+
+    def leaf(self, data):
+        return self.new(self.leaf_prefix + data).digest()
+
+    def node(self, children):
+        if self.hex_nodes:
+            children = binascii.hexlify(children)
+        return self.new(self.node_prefix + children).digest()
+
+def hash_backend(mode="hex"):
+    backend = HASH_BACKENDS.get(mode)
+    if backend is None:
+        backend = HASH_BACKENDS[mode] = HashBackend(mode)
+    return backend
 #viewing dataset
+#only the previewed lines are read, so this takes the same time for any
+#dataset size
 def view_dataset(path):
-    print("Loading 1,500,000 records from dataset...")
     preview_rows = []
     preview_limit = 100
-    load_limit = 1_500_000
-    with open(path, "r", encoding="utf-8") as f:
-        for idx, line in enumerate(f):
+    print(f"Loading the first {preview_limit} records from dataset...")
+    with open_dataset(path) as f:
+        for idx, line in enumerate(itertools.islice(f, preview_limit)):
             data = json.loads(line)
-            if idx < preview_limit:
-                real_id =(
-               data.get("reviewID") or
-               data.get("reviewerID") or
-               data.get("id") or
-               str(uuid.uuid4())
-)
-                full_text = data.get("reviewText", "")
-                short_text = (full_text[:55] + "...") if len(full_text) > 55 else full_text
-                preview_rows.append({
-                    "index": idx,
-                    "review_id": real_id,
-                    "asin": data.get("asin", ""),
-                    "rating": data.get("overall", ""),
-                    "text": short_text
-                })
-            if idx == load_limit:
-                break
+            real_id = record_id(data, idx)
+            full_text = data.get("reviewText", "")
+            short_text = (full_text[:55] + "...") if len(full_text) > 55 else full_text
+            preview_rows.append({
+                "index": idx,
+                "review_id": real_id,
+                "asin": data.get("asin", ""),
+                "rating": data.get("overall", ""),
+                "text": short_text
+            })
     df = pd.DataFrame(preview_rows)
     pd.set_option("display.max_colwidth", 60)
     pd.set_option("display.width", 200)
     print("\n=== FIRST 100 REVIEWS ===\n")
     print(df.to_string(index=False))
+#compressed dumps are opened transparently by extension
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSED_OPENERS
+
+#open a dataset file, plain or compressed, as utf-8 text or as bytes
+def open_dataset(path, mode="r"):
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(path)[1].lower())
+    binary = "b" in mode
+    if opener is None:
+        return open(path, "rb") if binary else open(path, "r", encoding="utf-8")
+    return opener(path, "rb") if binary else opener(path, "rt", encoding="utf-8")
+
+#precompiled patterns for clean_text
+TAG_RE = re.compile(r"<.*?>")
+SPACE_RE = re.compile(r"\s+")
+#lines per batch in the canonicalization stage
+LINE_BATCH = 10_000
+
 #normalizing and cleaning text
 def clean_text(text):
     if not text:
         return ""
-    text = unicodedata.normalize("NFKC", text)
-    text = re.sub(r"<.*?>", " ", text)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip().lower()
+#NFKC leaves pure-ASCII text unchanged, so it is only run on other text
+    if not text.isascii():
+        text = unicodedata.normalize("NFKC", text)
+    if "<" in text:
+        text = TAG_RE.sub(" ", text)
+#split() and strip() use the same whitespace set as \s, so this equals
+#SPACE_RE.sub(" ", text).strip() without building the middle string
+    return " ".join(text.split()).lower()
+
+#id used in a review's leaf; records without one get a key derived from
+#their content and line number so the leaf is the same on every run
+def record_id(data, line, version=LEAF_ENCODING_VERSION):
+    review_id = data.get("reviewID") or data.get("reviewerID") or data.get("id")
+    if review_id:
+        return review_id
+    if version == 1:
+        return str(uuid.uuid4())
+    content = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return "anon-" + sha256_hash(f"{line}|{content}")[:32]
+
+#text that a review's leaf hash is computed from; line is its line number
+def leaf_string(data, line, version=LEAF_ENCODING_VERSION):
+    get = data.get
+    review_id = record_id(data, line, version)
+    asin = (get("asin", "") or "").strip().upper()
+    rating = str(get("overall", "")).strip()
+#combine hashing on review_id, asin, rating, cleaned text
+    return review_id + "|" + asin + "|" + rating + "|" + clean_text(get("reviewText", ""))
+
+#canonicalization stage: parse a batch of JSONL lines (str or utf-8 bytes)
+#and build the encoded leaf text of each. first_line is the line number of
+#lines[0]. returns the encoded texts and the batch positions of lines that
+#could not be decoded, which are skipped
+def canonicalize_lines(lines, first_line=0, metrics=METRICS):
+    loads = json.loads
+    start = time.perf_counter()
+    records = []
+    skipped = []
+    for position, line in enumerate(lines):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            records.append((first_line + position, loads(line)))
+        except ValueError:
+            skipped.append(position)
+    parsed = time.perf_counter()
+    encoded = [leaf_string(data, line).encode("utf-8") for line, data in records]
+    metrics.add_time("json_parse", parsed - start)
+    metrics.add_time("text_clean", time.perf_counter() - parsed)
+    if skipped:
+        metrics.incr("lines_skipped", len(skipped))
+    return encoded, skipped
+
+#leaf digests of a batch of lines, packed, plus the skipped positions
+def hash_lines(lines, first_line=0, metrics=METRICS, mode="hex"):
+    encoded, skipped = canonicalize_lines(lines, first_line, metrics)
+    backend = hash_backend(mode)
+    new = backend.new
+    prefix = backend.leaf_prefix
+    start = time.perf_counter()
+#b"" + text is text itself, so the unprefixed modes pay nothing for this
+    digests = b"".join([new(prefix + text).digest() for text in encoded])
+    metrics.add_time("leaf_hash", time.perf_counter() - start)
+    metrics.incr("records", len(encoded))
+    metrics.incr("bytes", sum(map(len, lines)))
+    return digests, skipped
+
+#byte offset of each hashed line of a batch that starts at byte `start`;
+#skipped lines have no leaf, so they get no offset
+def leaf_offsets(lines, start, skipped=()):
+    offsets = array.array("Q", itertools.accumulate(map(len, lines[:-1]), initial=start))
+    if skipped:
+        skip = set(skipped)
+        offsets = array.array("Q", (o for position, o in enumerate(offsets) if position not in skip))
+    return offsets
+
+#the first `limit` lines of a file, LINE_BATCH lines at a time; lines are
+#bytes and decoded by canonicalize_lines, like the byte-range workers
+#start is a byte offset (into the decompressed stream for compressed files)
+#that must fall on a line boundary
+def iter_line_batches(path, limit=1_500_000, batch_size=LINE_BATCH, start=0):
+    if is_compressed(path):
+        yield from iter_decompressed_batches(path, limit, batch_size, start=start)
+        return
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = limit
+        while remaining > 0:
+            start = time.perf_counter()
+            batch = list(itertools.islice(f, min(batch_size, remaining)))
+            METRICS.add_time("file_read", time.perf_counter() - start)
+            if not batch:
+                break
+            remaining -= len(batch)
+            yield batch
+
+#compressed input: a reader thread decompresses and splits lines into a
+#bounded queue while the caller hashes, so the two overlap (zlib, bz2 and
+#lzma release the GIL while decompressing)
+def iter_decompressed_batches(path, limit=1_500_000, batch_size=LINE_BATCH, queue_size=8, start=0):
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
 
-def build_leaf_hashes(path, limit=1_500_000):
+    def produce():
+        try:
+            with open_dataset(path, "rb") as f:
+#seeking a compressed file decompresses up to the offset
+                if start:
+                    f.seek(start)
+                remaining = limit
+                while remaining > 0 and not stop.is_set():
+                    batch = list(itertools.islice(f, min(batch_size, remaining)))
+                    if not batch:
+                        break
+                    remaining -= len(batch)
+                    put(batch)
+#any failure is handed to the consumer, which would otherwise wait forever
+        except Exception as exc:
+            put(exc)
+        put(done)
+
+    reader = threading.Thread(target=produce, name="decompress", daemon=True)
+    reader.start()
+    try:
+        while True:
+            wait_start = time.perf_counter()
+            item = batches.get()
+#time spent waiting on the reader is the part of the read that did not overlap
+            METRICS.add_time("file_read", time.perf_counter() - wait_start)
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+#resumable builds: a small JSON checkpoint holding the input byte offset and
+#line count, saved every CHECKPOINT_EVERY lines next to a sidecar file of the
+#packed leaves hashed so far
+CHECKPOINT_EVERY = 200_000
+
+#identifies the input a checkpoint was written for without reading all of
+#it: size, mtime and a digest of the first MiB
+def checkpoint_fingerprint(path):
+    fingerprint = source_fingerprint(path, checksum=False)
+    del fingerprint["checksum_size"]
+    with open(path, "rb") as f:
+        fingerprint["source_checksum"] = hashlib.sha256(f.read(1 << 20)).hexdigest()
+    return fingerprint
+
+def new_checkpoint(path, kind, limit):
+    return {"kind": kind, "limit": limit, "leaf_encoding_version": LEAF_ENCODING_VERSION,
+            "fingerprint": checkpoint_fingerprint(path), "offset": 0, "lines": 0, "leaves": 0,
+            "complete": False}
+
+#written to a temp file and renamed, like save_tree
+def save_checkpoint(filename, state):
+    tmp = filename + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+#the saved state, or None when there is none or it belongs to another input,
+#kind of build or limit
+def load_checkpoint(filename, path, kind, limit):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if (state.get("kind") != kind or state.get("limit") != limit
+            or state.get("leaf_encoding_version") != LEAF_ENCODING_VERSION
+            or state.get("fingerprint") != checkpoint_fingerprint(path)):
+        print(f"Ignoring checkpoint {filename}: it was written for a different input or build.")
+        return None
+    return state
+
+def remove_checkpoint(filename):
+    for name in (filename, filename + ".leaves", filename + ".offsets"):
+        if os.path.exists(name):
+            os.remove(name)
+
+#state and leaves a leaf build starts from: the saved ones when the checkpoint
+#matches, otherwise a fresh state (or None without a checkpoint file)
+#when offsets (an array("Q")) is given, the saved record offsets are loaded
+#into it too, and a checkpoint saved without them is not used
+def resume_leaf_build(checkpoint, path, limit, offsets=None, mode="hex"):
+    if not checkpoint:
+        return None, bytearray()
+    size = hash_backend(mode).digest_size
+    state = load_checkpoint(checkpoint, path, f"leaves:{mode}", limit)
+    if state is not None and offsets is not None and not state.get("offsets"):
+        print(f"Ignoring checkpoint {checkpoint}: it has no record offsets.")
+        state = None
+    if state is not None:
+        with open(checkpoint + ".leaves", "rb") as f:
+            leaf_hashes = bytearray(f.read(state["leaves"] * size))
+        saved_offsets = array.array("Q")
+        if offsets is not None:
+            with open(checkpoint + ".offsets", "rb") as f:
+                saved_offsets.frombytes(f.read(state["leaves"] * saved_offsets.itemsize))
+        if (len(leaf_hashes) == state["leaves"] * size
+                and (offsets is None or len(saved_offsets) == state["leaves"])):
+            print(f"Resuming from checkpoint: {state['lines']:,} lines read, "
+                  f"{state['leaves']:,} leaves hashed")
+            if offsets is not None:
+                offsets.extend(saved_offsets)
+            return state, leaf_hashes
+        print(f"Ignoring checkpoint {checkpoint}: its sidecar files are short.")
+    state = new_checkpoint(path, f"leaves:{mode}", limit)
+    state.update(offsets=offsets is not None, digest_size=size)
+    return state, bytearray()
+
+#overwrite a sidecar file from byte `start` with data[start:] and fsync it
+def write_sidecar(filename, data, start):
+    with open(filename, "r+b" if os.path.exists(filename) else "wb") as f:
+        f.seek(start)
+        f.write(memoryview(data).cast("B")[start:])
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+
+#save progress once `every` lines have passed since the last checkpoint, or
+#always when the build is complete. only leaves past the last checkpoint are
+#written; the sidecar is fsynced before the checkpoint that refers to it
+def checkpoint_leaf_build(checkpoint, state, leaf_hashes, offset, lines, every=CHECKPOINT_EVERY,
+                          complete=False, offsets=None):
+    if state is None or (not complete and lines - state["lines"] < every):
+        return
+    size = state.get("digest_size", DIGEST_SIZE)
+    write_sidecar(checkpoint + ".leaves", leaf_hashes, state["leaves"] * size)
+    if offsets is not None:
+        write_sidecar(checkpoint + ".offsets", offsets, state["leaves"] * offsets.itemsize)
+    state.update(offset=offset, lines=lines, leaves=len(leaf_hashes) // size, complete=complete)
+    save_checkpoint(checkpoint, state)
+
+#with a checkpoint filename the build saves its progress there and an
+#interrupted build picks up from the last save; the caller removes the
+#checkpoint once it no longer needs the leaves
+#progress, when given a dict, receives the byte offset and line count the
+#build stopped at, which append_to_tree continues from. offsets, when given
+#an array("Q"), receives the byte offset of every leaf's line (see RecordIndex).
+#mode picks the hash backend (see HashBackend)
+def build_leaf_hashes(path, limit=1_500_000, packed=False, workers=1, checkpoint=None,
+                      every=CHECKPOINT_EVERY, progress=None, offsets=None, mode="hex"):
     print(f"\nLoading {limit:,} records and generating leaf hashes...")
-    leaf_hashes = []
-    with open(path, "r", encoding="utf-8") as f:
+    if workers != 1 and is_compressed(path):
+#compressed streams cannot be split by byte offset; the serial path still
+#overlaps decompression with hashing
+        print("Compressed input: hashing in one process with threaded decompression.")
+        workers = 1
+#packed keeps raw digests back to back in one buffer
+    size = hash_backend(mode).digest_size
+    state, leaf_hashes = resume_leaf_build(checkpoint, path, limit, offsets, mode)
+    if state and state["complete"]:
+        print("Checkpoint already holds every leaf.")
+        if progress is not None:
+            progress.update(offset=state["offset"], lines=state["lines"])
+    elif workers != 1:
+        leaf_hashes = build_leaf_hashes_parallel(path, limit, workers, checkpoint=checkpoint, state=state,
+                                                 leaf_hashes=leaf_hashes, every=every, progress=progress,
+                                                 offsets=offsets, mode=mode)
+    else:
+        offset = state["offset"] if state else 0
+        lines_read = state["lines"] if state else 0
+        for batch in iter_line_batches(path, limit - lines_read, start=offset):
+            digests, skipped = hash_lines(batch, lines_read, mode=mode)
+            leaf_hashes += digests
+            if offsets is not None:
+                offsets.extend(leaf_offsets(batch, offset, skipped))
+            if (lines_read + len(batch)) // 200_000 > lines_read // 200_000:
+                print(f"Processed {lines_read + len(batch):,} reviews...")
+            lines_read += len(batch)
+            offset += sum(map(len, batch))
+            checkpoint_leaf_build(checkpoint, state, leaf_hashes, offset, lines_read, every, offsets=offsets)
+        checkpoint_leaf_build(checkpoint, state, leaf_hashes, offset, lines_read, complete=True,
+                              offsets=offsets)
+        if progress is not None:
+            progress.update(offset=offset, lines=lines_read)
+    if not packed:
+        leaf_hashes = [leaf_hashes[i:i + size].hex() for i in range(0, len(leaf_hashes), size)]
+    count = len(leaf_hashes) // size if packed else len(leaf_hashes)
+    print(f"\nLeaf Hashes Created: {count:,}")
+    return leaf_hashes
+
+#yield (line number, record), skipping undecodable lines like build_leaf_hashes
+def iter_records(path, limit=1_500_000):
+    with open_dataset(path) as f:
         for idx, line in enumerate(f):
-#limit for 1,500,000 records
             if idx == limit:
                 break
             try:
-                data = json.loads(line)
+                yield idx, json.loads(line)
             except json.JSONDecodeError:
                 continue
-            review_id = (
-            data.get("reviewID") or
-            data.get("reviewerID") or
-            data.get("id") or
-            str(uuid.uuid4())
-)
 
-            asin = (data.get("asin", "") or "").strip().upper()
-            rating = str(data.get("overall", "")).strip()
-#clean the review text
-            text = clean_text(data.get("reviewText", ""))
-
-#combine hashing onn review_id, asin, rating, text
-            combined = review_id + "|" + asin + "|" + rating + "|" + text
-            leaf_hash = sha256_hash(combined)
-#add to leaf_hashes list
-            leaf_hashes.append(leaf_hash)
-            if idx % 200_000 == 0:
-                print(f"Processed {idx:,} reviews...")
-    print(f"\nLeaf Hashes Created: {len(leaf_hashes):,}")
+def leaf_digest(data, line, mode="hex"):
+    return hash_backend(mode).leaf(leaf_string(data, line).encode("utf-8"))
+
+#yield raw leaf digests one record at a time, same records as build_leaf_hashes
+def iter_leaf_hashes(path, limit=1_500_000, mode="hex"):
+    size = hash_backend(mode).digest_size
+    lines_read = 0
+    for batch in iter_line_batches(path, limit):
+        digests, _ = hash_lines(batch, lines_read, mode=mode)
+        lines_read += len(batch)
+        for start in range(0, len(digests), size):
+            yield digests[start:start + size]
+
+#split a file into byte ranges that start and end on line boundaries
+def split_byte_ranges(path, parts, start=0):
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path, "rb") as f:
+        for k in range(1, parts):
+            f.seek(max(start + (size - start) * k // parts, bounds[-1]))
+            if f.tell() > 0:
+#step back one byte so a cut that lands on a line start keeps that line
+                f.seek(f.tell() - 1)
+                f.readline()
+            bounds.append(max(f.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+#worker: number of lines starting inside [start, end)
+def count_lines_in_range(path, start, end):
+    count = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        last = b""
+        while remaining > 0:
+            block = f.read(min(1 << 24, remaining))
+            if not block:
+                break
+            count += block.count(b"\n")
+            remaining -= len(block)
+            last = block
+#a final line without a newline still counts
+    return count + (1 if last and not last.endswith(b"\n") else 0)
+
+#lines starting inside [start, end) of a binary file, LINE_BATCH at a time
+def iter_range_batches(f, start, end, batch_size=LINE_BATCH, metrics=METRICS):
+    f.seek(start)
+    pos = start
+    batch = []
+    read_start = time.perf_counter()
+    while pos < end:
+        raw = f.readline()
+        if not raw:
+            break
+        pos += len(raw)
+        batch.append(raw)
+        if len(batch) == batch_size:
+            metrics.add_time("file_read", time.perf_counter() - read_start)
+            yield batch
+            batch = []
+            read_start = time.perf_counter()
+    if batch:
+        metrics.add_time("file_read", time.perf_counter() - read_start)
+        yield batch
+
+#worker: hash every line that starts inside [start, end); first_line is the
+#file line number of the first of them, used for records without an id.
+#returns packed digests, lines read, line numbers (in the range) that were
+#skipped, the worker's stage metrics for the parent to merge and, when
+#with_offsets is set, the byte offset of each leaf's line
+def hash_byte_range(path, start, end, first_line=0, with_offsets=False, mode="hex"):
+    metrics = Metrics()
+    digests = []
+    skipped = []
+    offsets = array.array("Q")
+    lines = 0
+    pos = start
+    with open(path, "rb") as f:
+        for batch in iter_range_batches(f, start, end, metrics=metrics):
+            batch_digests, batch_skipped = hash_lines(batch, first_line + lines, metrics, mode)
+            digests.append(batch_digests)
+            skipped.extend(lines + position for position in batch_skipped)
+            if with_offsets:
+                offsets.extend(leaf_offsets(batch, pos, batch_skipped))
+                pos += sum(map(len, batch))
+            lines += len(batch)
+    return b"".join(digests), lines, skipped, metrics.raw(), offsets
+
+#process pool version of build_leaf_hashes; leaves come back in file order
+#workers=None uses every core
+#state and leaf_hashes continue a checkpointed build (see build_leaf_hashes);
+#progress is saved after whole ranges, in file order
+def build_leaf_hashes_parallel(path, limit=1_500_000, workers=None, chunks_per_worker=4, checkpoint=None,
+                               state=None, leaf_hashes=None, every=CHECKPOINT_EVERY, progress=None,
+                               offsets=None, mode="hex"):
+    workers = workers or os.cpu_count() or 1
+    offset = state["offset"] if state else 0
+    ranges = split_byte_ranges(path, workers * chunks_per_worker, offset)
+    leaf_hashes = bytearray() if leaf_hashes is None else leaf_hashes
+    lines_done = state["lines"] if state else 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+#line number each range starts at, from a fast newline count per range
+        first_lines = [lines_done]
+        for count in pool.map(count_lines_in_range, [path] * len(ranges),
+                              [a for a, _ in ranges], [b for _, b in ranges]):
+            first_lines.append(first_lines[-1] + count)
+        pending = []
+        next_range = 0
+        while next_range < len(ranges) or pending:
+#keep a bounded window of chunks in flight so a small limit stops early
+            while next_range < len(ranges) and len(pending) < 2 * workers:
+                if first_lines[next_range] >= limit:
+                    break
+                start, end = ranges[next_range]
+                future = pool.submit(hash_byte_range, path, start, end, first_lines[next_range],
+                                     offsets is not None, mode)
+                pending.append((future, start, end))
+                next_range += 1
+            if not pending:
+                break
+            future, start, offset = pending.pop(0)
+            digests, lines, skipped, worker_metrics, range_offsets = future.result()
+            METRICS.merge(worker_metrics)
+            if lines_done + lines >= limit:
+#keep only leaves from lines before the limit
+                keep = limit - lines_done
+                valid = keep - sum(1 for s in skipped if s < keep)
+                leaf_hashes += digests[:valid * hash_backend(mode).digest_size]
+                if offsets is not None:
+                    offsets.extend(range_offsets[:valid])
+                offset = skip_lines(path, start, keep)
+                lines_done = limit
+                for future, _, _ in pending:
+                    future.cancel()
+                break
+            leaf_hashes += digests
+            if offsets is not None:
+                offsets.extend(range_offsets)
+            lines_done += lines
+            print(f"Processed {lines_done:,} reviews...")
+            checkpoint_leaf_build(checkpoint, state, leaf_hashes, offset, lines_done, every, offsets=offsets)
+    checkpoint_leaf_build(checkpoint, state, leaf_hashes, offset, lines_done, complete=True, offsets=offsets)
+    if progress is not None:
+        progress.update(offset=offset, lines=lines_done)
     return leaf_hashes
 
+#byte offset just past the first `count` lines that start at `start`
+def skip_lines(path, start, count):
+    with open(path, "rb") as f:
+        f.seek(start)
+        for _ in range(count):
+            if not f.readline():
+                break
+        return f.tell()
+
 def build_parent_layer(hashes):
     parent_layer = []
     n = len(hashes)
@@ -96,152 +624,1174 @@ def build_parent_layer(hashes):
 #odd 
             parent_layer.append(sha256_hash(hashes[i]))
     return parent_layer
-#merkle root building
-def build_merkle_root(leaf_hashes):
-    print("\nBuilding Merkle Tree...")
-    current_layer = leaf_hashes
-    layer = 0
-    print(f"Layer {layer}: {len(current_layer):,} nodes")
-    while len(current_layer) > 1:
-        current_layer = build_parent_layer(current_layer)
-        layer += 1
-        print(f"Layer {layer}: {len(current_layer):,} nodes")
-    print("FINAL MERKLE ROOT:")
-    print(current_layer[0])
-    return current_layer[0]
-
-def update_leaf_hashes_partial(original_path, tampered_path, original_leaf_hashes):
-#update tampered leaf hash 
-    updated = original_leaf_hashes.copy()
-    with open(original_path, "r", encoding="utf-8") as fo, \
-         open(tampered_path, "r", encoding="utf-8") as ft:
-        for idx, (lo, lt) in enumerate(zip(fo, ft)):
-            if lo != lt:
-                data = json.loads(lt)
-                review_id = (
-                data.get("reviewID") or
-                data.get("reviewerID") or
-                data.get("id") or
-                str(uuid.uuid4())
-)
-
-                asin = (data.get("asin", "") or "").strip().upper()
-                rating = str(data.get("overall", "")).strip()
-                text = clean_text(data.get("reviewText", ""))
-                combined = review_id + "|" + asin + "|" + rating + "|" + text
-#update the tampered index
-                updated[idx] = sha256_hash(combined)
-                return updated, idx
-    return updated, None
-
-
-#update the parents of the tampered leaf
-def recompute_partial_root(leaf_hashes, changed_index):
-    layer = leaf_hashes.copy()
-    idx = changed_index
-    while len(layer) > 1:
-        n = len(layer)
-        parent_layer = []
-        for i in range(0, n, 2):
-            if i + 1 < n:
-                parent_layer.append(sha256_hash(layer[i] + layer[i+1]))
+#pack a list of hex leaf hashes into one buffer of raw digests
+def pack_hashes(hex_hashes, batch=65_536):
+    packed = bytearray()
+    for i in range(0, len(hex_hashes), batch):
+        packed += bytes.fromhex("".join(hex_hashes[i:i + batch]))
+    return packed
+
+#hash one node from its 1 or 2 child digests
+#"hex" mode hashes the hex text of the children like sha256_hash(a + b),
+#so roots match the ones written by save_root; "raw" hashes the bytes directly
+#and the other modes hash the node prefix and the bytes (see HashBackend)
+def hash_node(children, mode="hex"):
+    return hash_backend(mode).node(children)
+
+def build_parent_digests(layer, mode="hex", block_pairs=8192):
+    backend = hash_backend(mode)
+    new = backend.new
+    prefix = backend.node_prefix
+    hexlify = binascii.hexlify
+    parent = bytearray()
+#work in blocks so the hex text of a layer is never held in memory at once
+    block = 2 * backend.digest_size * block_pairs
+    for start in range(0, len(layer), block):
+        chunk = bytes(layer[start:start + block])
+        step = 2 * backend.digest_size
+        if backend.hex_nodes:
+            chunk = hexlify(chunk)
+            step *= 2
+#the last slice is a single digest on odd layers, so it is rehashed alone
+        if prefix:
+            parent += b"".join([new(prefix + chunk[i:i + step]).digest()
+                                for i in range(0, len(chunk), step)])
+        else:
+            parent += b"".join([new(chunk[i:i + step]).digest()
+                                for i in range(0, len(chunk), step)])
+    return parent
+
+#tree object that keeps every layer so proofs are index reads
+#each layer is one contiguous buffer of raw digest_size digests
+class MerkleTree:
+    def __init__(self, layers, mode="hex"):
+        self.layers = layers
+        self.mode = mode
+        self.digest_size = hash_backend(mode).digest_size
+#seconds spent in each build phase, filled in by build_merkle_tree
+        self.timings = {}
+#header fields of the tree file it was loaded from or saved to
+        self.metadata = {}
+
+    @property
+    def root(self):
+        return self.root_digest.hex()
+
+    @property
+    def root_digest(self):
+        return bytes(self.layers[-1][:self.digest_size])
+
+    @property
+    def leaf_count(self):
+        return len(self.layers[0]) // self.digest_size
+
+    @property
+    def height(self):
+        return len(self.layers) - 1
+
+    def layer_size(self, level):
+        return len(self.layers[level]) // self.digest_size
+
+    def node(self, level, index):
+        start = index * self.digest_size
+        return bytes(self.layers[level][start:start + self.digest_size])
+
+    def leaf(self, index):
+        return self.node(0, index).hex()
+
+    def leaf_hashes(self):
+        layer = self.layers[0]
+        size = self.digest_size
+        return [layer[i:i + size].hex() for i in range(0, len(layer), size)]
+
+#sibling of a node and which side it sits on
+    def sibling(self, level, index):
+        if index % 2 == 0:
+            if index + 1 < self.layer_size(level):
+                return self.node(level, index + 1).hex(), "right"
+            return None, "single"
+        return self.node(level, index - 1).hex(), "left"
+
+    def proof(self, index):
+        if not 0 <= index < self.leaf_count:
+            raise IndexError(f"leaf index {index} out of range")
+        start = time.perf_counter()
+        proof = []
+        for level in range(self.height):
+            proof.append(self.sibling(level, index))
+            index //= 2
+        METRICS.add_time("proof", time.perf_counter() - start)
+        return proof
+
+#rehash only the ancestors of the changed leaves; each shared ancestor once
+#changes is an iterable of (index, new_leaf) with hex or raw digests
+#returns {index: digest} for every level, leaves first, root last
+    def propagate(self, changes):
+        current = {}
+        for index, leaf in changes:
+            if not 0 <= index < self.leaf_count:
+                raise IndexError(f"leaf index {index} out of range")
+            current[index] = bytes.fromhex(leaf) if isinstance(leaf, str) else bytes(leaf)
+        levels = [current]
+        for level in range(self.height):
+            size = self.layer_size(level)
+            parents = {}
+            for parent in {index // 2 for index in current}:
+                left = 2 * parent
+                children = current.get(left) or self.node(level, left)
+                if left + 1 < size:
+                    children += current.get(left + 1) or self.node(level, left + 1)
+                parents[parent] = hash_node(children, self.mode)
+            levels.append(parents)
+            current = parents
+        return levels
+
+#root the tree would have after the changes, leaving the tree untouched
+    def root_with(self, changes):
+        levels = self.propagate(changes)
+        return levels[-1][0].hex() if levels[-1] else self.root
+
+#apply the changes in place and return the new root
+    def update_leaves(self, changes):
+        size = self.digest_size
+        for level, nodes in enumerate(self.propagate(changes)):
+            layer = self.layers[level]
+            for index, digest in nodes.items():
+                layer[index * size:(index + 1) * size] = digest
+        return self.root
+
+    def update_leaf(self, index, new_leaf):
+        return self.update_leaves([(index, new_leaf)])
+
+#add packed leaf digests at the right edge and return the new root. nodes
+#left of the old last node on each level are kept; only the right spine
+#and the new nodes are hashed. in-memory (bytearray) layers are extended in
+#place, so k new leaves cost O(k + log n); the kept prefix of a mapped or
+#read-only layer is copied once, so a memory-mapped tree becomes an
+#in-memory one
+    def append_leaves(self, digests):
+        if not digests:
+            return self.root
+        size = self.digest_size
+        first = self.leaf_count
+        leaves = self.layers[0]
+        layers = [leaves if isinstance(leaves, bytearray) else bytearray(leaves)]
+        layers[0] += digests
+        level = 0
+        while len(layers[-1]) > size:
+            first //= 2
+            parent = self.layers[level + 1] if level + 1 < len(self.layers) else bytearray()
+            if isinstance(parent, bytearray):
+#drops the old right-edge node, which is rehashed with its new sibling
+                del parent[first * size:]
             else:
-                parent_layer.append(sha256_hash(layer[i]))
-        idx //= 2
-        layer = parent_layer
-    return layer[0]
+                parent = bytearray(parent[:first * size])
+            parent += build_parent_digests(layers[-1][2 * first * size:], self.mode)
+            layers.append(parent)
+            level += 1
+        self.layers = layers
+        return self.root
+
+#worker: build the bottom `levels` layers of one power-of-two leaf block
+#a partial last block keeps rehashing its lone node, exactly as the full
+#layer-by-layer build does at the right edge of the tree
+def build_subtree_layers(block, levels, mode="hex"):
+    layers = []
+    current = block
+    for _ in range(levels):
+        current = build_parent_digests(current, mode)
+        layers.append(bytes(current))
+    return layers
+
+#merkle tree building
+#workers other than 1 builds independent subtrees in a process pool first
+def build_merkle_tree(leaf_hashes, verbose=True, mode="hex", workers=1, subtree_levels=None):
+    if verbose:
+        print("\nBuilding Merkle Tree...")
+    if isinstance(leaf_hashes, list):
+        current_layer = pack_hashes(leaf_hashes)
+    elif isinstance(leaf_hashes, bytearray):
+#packed leaves are adopted as layer 0 without a copy
+        current_layer = leaf_hashes
+    else:
+        current_layer = bytearray(leaf_hashes)
+    if not current_layer:
+        raise ValueError("cannot build a Merkle tree with no leaves")
+    size = hash_backend(mode).digest_size
+    layers = [current_layer]
+    timings = {}
+    if verbose:
+        print(f"Layer 0: {len(current_layer) // size:,} nodes")
+    if workers != 1:
+        start = time.time()
+        layers.extend(build_subtree_layers_parallel(current_layer, mode, workers, subtree_levels))
+        current_layer = layers[-1]
+        timings["subtrees"] = time.time() - start
+        METRICS.add_time("tree_subtrees", timings["subtrees"])
+        if verbose:
+            for level in range(1, len(layers)):
+                print(f"Layer {level}: {len(layers[level]) // size:,} nodes (sharded)")
+    start = time.time()
+    while len(current_layer) > size:
+        layer_start = time.perf_counter()
+        current_layer = build_parent_digests(current_layer, mode)
+        METRICS.add_time(f"tree_layer_{len(layers)}", time.perf_counter() - layer_start)
+        layers.append(current_layer)
+        if verbose:
+            print(f"Layer {len(layers) - 1}: {len(current_layer) // size:,} nodes")
+    timings["top layers" if workers != 1 else "layers"] = time.time() - start
+    tree = MerkleTree(layers, mode)
+    tree.timings = timings
+    if verbose:
+        print("FINAL MERKLE ROOT:")
+        print(tree.root)
+    return tree
+
+#build the lower layers as power-of-two subtrees in parallel and stitch them
+#together level by level; returns layers 1..levels (empty if too few leaves)
+def build_subtree_layers_parallel(leaves, mode="hex", workers=None, levels=None):
+    workers = workers or os.cpu_count() or 1
+    size = hash_backend(mode).digest_size
+    leaf_count = len(leaves) // size
+    if levels is None:
+#about four blocks per worker, never below 1024 leaves per block
+        levels = max(10, (leaf_count // (workers * 4)).bit_length() - 1)
+    block_leaves = 1 << levels
+    if leaf_count <= block_leaves:
+        return []
+    block = block_leaves * size
+    stitched = [bytearray() for _ in range(levels)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(build_subtree_layers, bytes(leaves[i:i + block]), levels, mode)
+                   for i in range(0, len(leaves), block)]
+        for future in futures:
+            for level, layer in enumerate(future.result()):
+                stitched[level] += layer
+    return stitched
+
+def build_merkle_root(leaf_hashes, mode="hex"):
+    return build_merkle_tree(leaf_hashes, mode=mode).root
+
+#constant-memory root builder: keeps only a stack of pending subtree roots,
+#one per set bit of the leaf count, so memory is O(log n)
+class StreamingMerkleBuilder:
+    def __init__(self, mode="hex"):
+        self.mode = mode
+        self.leaf_count = 0
+#(level, digest) pairs with strictly decreasing levels
+        self.stack = []
+
+    def add(self, leaf):
+        digest = bytes.fromhex(leaf) if isinstance(leaf, str) else bytes(leaf)
+        level = 0
+        while self.stack and self.stack[-1][0] == level:
+            _, left = self.stack.pop()
+            digest = hash_node(left + digest, self.mode)
+            level += 1
+        self.stack.append((level, digest))
+        self.leaf_count += 1
+
+#fold the pending roots right to left; a lone right subtree is rehashed
+#alone until it reaches its left neighbour's level, like the odd-node rule
+    @property
+    def root_digest(self):
+        if not self.stack:
+            raise ValueError("cannot build a Merkle tree with no leaves")
+        level, digest = self.stack[-1]
+        for left_level, left in reversed(self.stack[:-1]):
+            while level < left_level:
+                digest = hash_node(digest, self.mode)
+                level += 1
+            digest = hash_node(left + digest, self.mode)
+            level += 1
+        return digest
+
+    @property
+    def root(self):
+        return self.root_digest.hex()
+
+#the pending roots as plain data for a checkpoint, and back
+    def checkpoint_state(self):
+        return {"leaves": self.leaf_count, "stack": [[level, digest.hex()] for level, digest in self.stack]}
+
+    @classmethod
+    def from_checkpoint(cls, state, mode="hex"):
+        builder = cls(mode)
+        builder.leaf_count = state["leaves"]
+        builder.stack = [(level, bytes.fromhex(digest)) for level, digest in state["stack"]]
+        return builder
+
+def stream_merkle_root(leaves, mode="hex"):
+    builder = StreamingMerkleBuilder(mode)
+    for leaf in leaves:
+        builder.add(leaf)
+    return builder.root
+
+#read, parse, hash and fold the dataset in a single pass. with a checkpoint
+#filename the pending subtree stack is saved every `every` lines, so an
+#interrupted run resumes from there; the checkpoint is removed at the end
+def build_merkle_root_streaming(path, limit=1_500_000, mode="hex", checkpoint=None, every=CHECKPOINT_EVERY):
+    print(f"\nStreaming {limit:,} records into the Merkle root...")
+    kind = f"stack:{mode}"
+    state = load_checkpoint(checkpoint, path, kind, limit) if checkpoint else None
+    if state:
+        builder = StreamingMerkleBuilder.from_checkpoint(state, mode)
+        print(f"Resuming from checkpoint: {state['lines']:,} lines read, {builder.leaf_count:,} leaves folded")
+    else:
+        builder = StreamingMerkleBuilder(mode)
+        state = new_checkpoint(path, kind, limit) if checkpoint else None
+    offset = state["offset"] if state else 0
+    lines_read = state["lines"] if state else 0
+    size = hash_backend(mode).digest_size
+    for batch in iter_line_batches(path, limit - lines_read, start=offset):
+        digests, _ = hash_lines(batch, lines_read, mode=mode)
+        for start in range(0, len(digests), size):
+            builder.add(digests[start:start + size])
+        if (lines_read + len(batch)) // 200_000 > lines_read // 200_000:
+            print(f"Processed {lines_read + len(batch):,} reviews...")
+        lines_read += len(batch)
+        offset += sum(map(len, batch))
+        if state and lines_read - state["lines"] >= every:
+            state.update(builder.checkpoint_state(), offset=offset, lines=lines_read)
+            save_checkpoint(checkpoint, state)
+    if checkpoint:
+        remove_checkpoint(checkpoint)
+    print(f"\nLeaves streamed: {builder.leaf_count:,}")
+    print("FINAL MERKLE ROOT:")
+    print(builder.root)
+    return builder.root
+
+#compare two datasets line by line and rehash only the lines that differ.
+#returns {index: new leaf digest} for every leaf of the tree that changed,
+#or None when lines and leaves cannot be matched by position: the files
+#have different line counts, a changed line does not decode or holds a
+#different record (a delete plus an insert keeps the line count but shifts
+#every record between them), or the tree has fewer leaves than lines
+#(undecodable lines were skipped when it was built)
+def update_leaf_hashes_partial(original_path, tampered_path, original_tree, limit=1_500_000):
+    changes = {}
+    lines = 0
+    with open_dataset(original_path, "rb") as fo, open_dataset(tampered_path, "rb") as ft:
+        for idx, (lo, lt) in enumerate(itertools.zip_longest(fo, ft)):
+            if idx == limit:
+                break
+            if lo is None or lt is None:
+                return None
+            lines += 1
+            if lo == lt:
+                continue
+            try:
+                old, new = json.loads(lo), json.loads(lt)
+            except ValueError:
+                return None
+            if record_key(old) != record_key(new):
+                return None
+            digest = leaf_digest(new, idx, original_tree.mode)
+#a line that only changed its formatting keeps its leaf
+            if digest != original_tree.node(0, idx):
+                changes[idx] = digest
+    if lines != original_tree.leaf_count:
+        return None
+    return changes
+
+
+#update only the parents of the tampered leaves on the stored tree
+#the tree itself is not modified, only the new root is returned
+def recompute_partial_root(tree, changes):
+    if isinstance(changes, dict):
+        changes = changes.items()
+    return tree.root_with(changes)
+
+
+#top-down diff of two trees: descend from the roots and skip every subtree
+#whose hashes match, so k changed leaves cost O(k log n) comparisons.
+#leaves past the shorter tree count as changed. returns sorted leaf indices
+def diff_trees(original_tree, other_tree):
+    if original_tree.mode != other_tree.mode:
+        raise ValueError("cannot diff trees built in different hash modes")
+    common = min(original_tree.leaf_count, other_tree.leaf_count)
+    total = max(original_tree.leaf_count, other_tree.leaf_count)
+    changed = []
+    stack = [(max(original_tree.height, other_tree.height), 0)]
+    while stack:
+        level, index = stack.pop()
+        first = index << level
+        last = min((index + 1) << level, total)
+        if first >= total:
+            continue
+        if first >= common:
+            changed.extend(range(first, last))
+            continue
+#only full subtrees inside both trees are comparable; edge nodes also
+#depend on the odd-node rule so they are always descended into
+        if last <= common and original_tree.node(level, index) == other_tree.node(level, index):
+            continue
+        if level == 0:
+            changed.append(first)
+            continue
+        stack.append((level - 1, 2 * index + 1))
+        stack.append((level - 1, 2 * index))
+    return changed
+
+
+#identity of a review that survives edits to its text or rating
+#(review id and product); 16 bytes of sha256 keeps the index small
+def record_key(data):
+    review_id = data.get("reviewID") or data.get("reviewerID") or data.get("id") or ""
+    asin = (data.get("asin", "") or "").strip().upper()
+    return hashlib.sha256(f"{review_id}|{asin}".encode("utf-8")).digest()[:16]
+
+#one pass over a dataset: record key -> position, plus the packed leaf digests
+#and the line number of each record. a key seen more than once (every record
+#without an id shares one) maps to a deque of positions in file order
+def build_record_index(path, limit=1_500_000, mode="hex"):
+    index = {}
+    leaves = bytearray()
+    lines = array.array("Q")
+    for position, (line, data) in enumerate(iter_records(path, limit)):
+        leaves += leaf_digest(data, line, mode)
+        lines.append(line)
+        key = record_key(data)
+        existing = index.get(key)
+        if existing is None:
+            index[key] = position
+        elif isinstance(existing, collections.deque):
+            existing.append(position)
+        else:
+            index[key] = collections.deque([existing, position])
+    return index, leaves, lines
+
+#align two datasets by record key instead of position, so an insert or a
+#delete is reported once rather than shifting every later record.
+#returns modified (old, new) pairs, inserted new positions, deleted old positions.
+#leaves, a bytearray, gets the tampered file's packed leaf digests, the same
+#as build_leaf_hashes, so its tree needs no second pass over the file
+def align_records(original_path, tampered_path, limit=1_500_000, mode="hex", leaves=None):
+    index, original_leaves, lines = build_record_index(original_path, limit, mode)
+    size = hash_backend(mode).digest_size
+    modified = []
+    inserted = []
+    for position, (line, data) in enumerate(iter_records(tampered_path, limit)):
+        digest = None
+        if leaves is not None:
+            digest = leaf_digest(data, line, mode)
+            leaves += digest
+        key = record_key(data)
+        match = index.get(key)
+        if match is None:
+            inserted.append(position)
+            continue
+#duplicate keys are matched to the original occurrences in order
+        if isinstance(match, collections.deque):
+            original = match.popleft()
+            if not match:
+                del index[key]
+        else:
+            original = match
+            del index[key]
+#a record without an id hashes its line number, so a shifted one is
+#rehashed at the original line to still match
+        if digest is None or (line != lines[original]
+                              and not (data.get("reviewID") or data.get("reviewerID") or data.get("id"))):
+            digest = leaf_digest(data, lines[original], mode)
+        start = original * size
+        if digest != original_leaves[start:start + size]:
+            modified.append((original, position))
+    deleted = []
+    for match in index.values():
+        deleted.extend(match if isinstance(match, collections.deque) else [match])
+    deleted.sort()
+    return {"modified": modified, "inserted": inserted, "deleted": deleted}
+
+def print_alignment(alignment, shown=20):
+    for kind, label in [("modified", "Modified"), ("inserted", "Inserted"), ("deleted", "Deleted")]:
+        items = alignment[kind]
+#modified entries are printed as original->tampered positions
+        preview = ", ".join(f"{i[0]}->{i[1]}" if isinstance(i, tuple) else str(i) for i in items[:shown])
+        more = f" (+{len(items) - shown:,} more)" if len(items) > shown else ""
+        print(f"{label + ':':<10}{len(items):,}  {preview}{more}")
 
 
 #checking integrity of dataset
-def check_integrity_partial(original_path, tampered_path, saved_root, original_leaf_hashes):
+#a tampered tree passed in is diffed top-down from the roots without reading
+#either file, or aligned by record key when the leaf counts differ.
+#without one, when the two files line up record for record, only the changed
+#lines are rehashed and the new root comes from the stored tree's changed
+#ancestors; otherwise the datasets are aligned by record key, so inserts and
+#deletes are reported once instead of as a shift, and the tampered tree is
+#built from the leaves the alignment hashed. align=False forces the positional
+#tree diff, align=True skips the positional pass
+def check_integrity_partial(original_path, tampered_path, saved_root, original_tree, tampered_tree=None,
+                            align=None):
     print("\nChecking dataset integrity...")
-#update leaf hashes with tampered dataset
-    updated_leaf_hashes, changed_index = update_leaf_hashes_partial(
-        original_path, tampered_path, original_leaf_hashes
-    )
-    if changed_index is None:
+    if original_tree.metadata.get("source_size") and not tree_matches_source(original_tree, original_path):
+        print("Warning: original dataset changed since its tree was saved.")
+    if original_tree.metadata.get("leaf_encoding_version", LEAF_ENCODING_VERSION) != LEAF_ENCODING_VERSION:
+        print("Warning: original tree uses an older leaf encoding, so every record may differ.")
+    changes = None
+    if tampered_tree is None and not align:
+        changes = update_leaf_hashes_partial(original_path, tampered_path, original_tree)
+    if changes is not None:
+        start = time.perf_counter()
+        new_root = recompute_partial_root(original_tree, changes)
+        elapsed_us = (time.perf_counter() - start) * 1_000_000
+        changed = sorted(changes)
+        if not changed:
+            print("No detectable change.")
+        else:
+            shown = ", ".join(str(i) for i in changed[:20])
+            more = f" (+{len(changed) - 20:,} more)" if len(changed) > 20 else ""
+            print(f"\nChanged records: {len(changed):,}")
+            print(f"Changed indices: {shown}{more}")
+        print(f"Partial root recompute: {elapsed_us:.1f} µs for {len(changes)} change(s)")
+        print("\nOriginal Root:", saved_root)
+        print("New Root:     ", new_root)
+        print("\nDATASET IS INTACT" if new_root == saved_root else "\nTAMPERING DETECTED")
+        return changed
+    if tampered_tree is None and align is False:
+        tampered_tree = build_merkle_tree(
+            build_leaf_hashes(tampered_path, packed=True, workers=None, mode=original_tree.mode),
+            verbose=False, mode=original_tree.mode
+        )
+    start = time.perf_counter()
+    if tampered_tree is None:
+#the files did not line up, so they are aligned by key; the alignment hashes
+#the tampered leaves on the way and the tampered tree is built from those
+        tampered_leaves = bytearray()
+        changed = align_records(original_path, tampered_path, mode=original_tree.mode, leaves=tampered_leaves)
+        tampered_tree = build_merkle_tree(tampered_leaves, verbose=False, mode=original_tree.mode)
+    elif align or (align is None and tampered_tree.leaf_count != original_tree.leaf_count):
+        changed = align_records(original_path, tampered_path, mode=original_tree.mode)
+    else:
+        changed = diff_trees(original_tree, tampered_tree)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if isinstance(changed, dict):
+        print(f"\nRecords aligned by key in {elapsed_ms:.2f} ms")
+        print_alignment(changed)
+    elif not changed:
         print("No detectable change.")
-        return
-    print(f"\nFirst detected difference at index: {changed_index}")
-#recompute the root after tampering
-    new_root = recompute_partial_root(updated_leaf_hashes, changed_index)
+    else:
+        shown = ", ".join(str(i) for i in changed[:20])
+        more = f" (+{len(changed) - 20:,} more)" if len(changed) > 20 else ""
+        print(f"\nChanged records: {len(changed):,} found in {elapsed_ms:.2f} ms")
+        print(f"Changed indices: {shown}{more}")
     print("\nOriginal Root:", saved_root)
-    print("New Root:     ", new_root)
-    if new_root == saved_root:
+    print("New Root:     ", tampered_tree.root)
+    if tampered_tree.root == saved_root:
         print("\nDATASET IS INTACT")
     else:
         print("\nTAMPERING DETECTED")
+    return changed
 
 
 #generating and verifying proof
-def generate_proof(index, leaf_hashes):
-    proof = []
-    current_index = index
-    layer = leaf_hashes.copy()
-
-    while len(layer) > 1:
-        n = len(layer)
-
-        if current_index % 2 == 0:   # left child
-            sibling_index = current_index + 1
-            if sibling_index < n:
-                proof.append((layer[sibling_index], "right"))
-            else:
-                proof.append((None, "single"))
-        else:                       # right child
-            sibling_index = current_index - 1
-            proof.append((layer[sibling_index], "left"))
-
-        parent_layer = []
-        for i in range(0, n, 2):
-            if i + 1 < n:
-                parent_layer.append(sha256_hash(layer[i] + layer[i+1]))
-            else:
-                parent_layer.append(sha256_hash(layer[i]))
-
-        current_index //= 2
-        layer = parent_layer
-
-    return proof
-
-def verify_proof(target_hash, proof, merkle_root):
-    start_time = time.time()
-
-    computed = target_hash
+def generate_proof(index, tree):
+#accepts a built tree, or a plain leaf list which is built once here
+    if not isinstance(tree, MerkleTree):
+        tree = build_merkle_tree(tree, verbose=False)
+    return tree.proof(index)
+
+#fold a single proof path up to the root digest
+def compute_proof_root(target_hash, proof, mode="hex"):
+    computed = bytes.fromhex(target_hash)
     for sibling_hash, direction in proof:
         if direction == "left":
-            computed = sha256_hash(sibling_hash + computed)
+            computed = hash_node(bytes.fromhex(sibling_hash) + computed, mode)
         elif direction == "right":
-            computed = sha256_hash(computed + sibling_hash)
+            computed = hash_node(computed + bytes.fromhex(sibling_hash), mode)
         else:
-            computed = sha256_hash(computed)
+            computed = hash_node(computed, mode)
+    return computed
+
+def verify_proof(target_hash, proof, merkle_root, mode="hex"):
+    start_time = time.time()
+
+    computed = compute_proof_root(target_hash, proof, mode)
 
     end_time = time.time()
+    METRICS.add_time("verify", end_time - start_time)
     elapsed_ms = (end_time - start_time) * 1000
 
     print(f"\n[VERIFICATION TIME] Proof verified in {elapsed_ms:.2f} ms")
 
-    return computed == merkle_root
+    return computed.hex() == merkle_root
+
+#worker: verify a chunk of (leaf, proof) pairs, one result byte per pair
+def verify_proof_chunk(chunk, merkle_root, mode="hex"):
+#timed into a local registry that the parent merges, since a pool worker's
+#METRICS is lost when the worker exits
+    metrics = Metrics()
+    start = time.perf_counter()
+    root = bytes.fromhex(merkle_root)
+    results = bytes(compute_proof_root(leaf, proof, mode) == root for leaf, proof in chunk)
+    metrics.add_time("verify", time.perf_counter() - start, len(chunk))
+    return results, metrics.raw()
+
+#quiet bulk verification: items are (leaf_hash, proof) pairs, or
+#{index: leaf_hash} when a multiproof is given. returns a bytearray with
+#1 for a valid proof and 0 otherwise, plus aggregate timing stats. a
+#multiproof is one check over the whole set, so every item gets the same
+#result and a failure cannot say which leaf was wrong
+def verify_proofs_batch(items, merkle_root, mode="hex", workers=1, chunk_size=4096, multiproof=None):
+    start = time.perf_counter()
+    if multiproof is not None:
+        targets = multiproof_targets(multiproof)
+        keys = items.keys() if isinstance(items, dict) else [key for key, _ in items]
+        extra = [key for key in keys
+                 if (tuple(map(int, key)) if isinstance(key, (tuple, list)) else (0, int(key))) not in targets]
+        if extra:
+            raise ValueError(f"leaves {extra} are not targets of the multiproof")
+        valid = verify_multiproof(items, multiproof, merkle_root)
+        results = bytearray([valid]) * len(items)
+        workers = 1
+    else:
+        items = list(items)
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        results = bytearray()
+        if workers == 1:
+            for chunk in chunks:
+                chunk_results, chunk_metrics = verify_proof_chunk(chunk, merkle_root, mode)
+                METRICS.merge(chunk_metrics)
+                results += chunk_results
+        else:
+            workers = workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for chunk_results, chunk_metrics in pool.map(verify_proof_chunk, chunks,
+                                                             [merkle_root] * len(chunks), [mode] * len(chunks)):
+                    METRICS.merge(chunk_metrics)
+                    results += chunk_results
+    seconds = time.perf_counter() - start
+    valid_count = sum(results)
+    stats = {
+        "proofs": len(results),
+        "valid": valid_count,
+        "invalid": len(results) - valid_count,
+        "seconds": seconds,
+        "proofs_per_sec": len(results) / seconds if seconds else 0.0,
+        "workers": workers,
+    }
+    return results, stats
+
+
+#batched proof for many leaves at once: every sibling shared between the
+#paths is sent once and nodes the verifier can compute are left out.
+#targets may also be given per level as {level: indices} for inner nodes
+def generate_multiproof(tree, indices):
+    targets = indices if isinstance(indices, dict) else {0: indices}
+    for level, wanted in targets.items():
+        for index in wanted:
+            if not 0 <= index < tree.layer_size(level):
+                raise IndexError(f"node {index} out of range on level {level}")
+    nodes = []
+    known = set()
+    for level in range(tree.height):
+        known |= set(targets.get(level, ()))
+        size = tree.layer_size(level)
+        for index in sorted(known):
+            sibling = index ^ 1
+            if sibling < size and sibling not in known:
+                nodes.append((level, sibling, tree.node(level, sibling).hex()))
+        known = {index // 2 for index in known}
+    return {
+        "leaf_count": tree.leaf_count,
+        "mode": tree.mode,
+#pairs rather than a dict so the proof survives JSON, which turns int keys into strings
+        "targets": [[level, sorted(wanted)] for level, wanted in sorted(targets.items())],
+        "nodes": nodes,
+    }
 
+#the (level, index) nodes a multiproof was generated for
+def multiproof_targets(multiproof):
+    targets = multiproof["targets"]
+    pairs = targets.items() if isinstance(targets, dict) else targets
+    return {(int(level), int(index)) for level, indices in pairs for index in indices}
+
+#rebuild the root from known node hashes plus the multiproof nodes.
+#leaves is {index: hash} for leaf targets, or {(level, index): hash}, or
+#the same as [key, hash] pairs; index keys may be strings, as after JSON.
+#the keys must be exactly the proof's targets, each inside its layer, or
+#a made-up node past the right edge of an odd layer would go unhashed
+def verify_multiproof(leaves, multiproof, merkle_root):
+    mode = multiproof.get("mode", "hex")
+    sizes = layer_sizes(multiproof["leaf_count"])
+    known_by_level = {}
+    for key, value in leaves.items() if isinstance(leaves, dict) else leaves:
+        level, index = map(int, key) if isinstance(key, (tuple, list)) else (0, int(key))
+        if not (0 <= level < len(sizes) and 0 <= index < sizes[level]):
+            return False
+        known_by_level.setdefault(level, {})[index] = bytes.fromhex(value)
+    given = {(level, index) for level, nodes in known_by_level.items() for index in nodes}
+    if given != multiproof_targets(multiproof):
+        return False
+    supplied = {}
+    for level, index, value in multiproof["nodes"]:
+        supplied.setdefault(level, {})[index] = bytes.fromhex(value)
+    known = {}
+    for level in range(len(sizes) - 1):
+        known.update(known_by_level.get(level, {}))
+        nodes = supplied.get(level, {})
+        parents = {}
+        for parent in {index // 2 for index in known}:
+            left = 2 * parent
+            children = known.get(left) or nodes.get(left)
+            if children is None:
+                return False
+            if left + 1 < sizes[level]:
+                right = known.get(left + 1) or nodes.get(left + 1)
+                if right is None:
+                    return False
+                children += right
+            parents[parent] = hash_node(children, mode)
+        known = parents
+    known.update(known_by_level.get(len(sizes) - 1, {}))
+    return 0 in known and known[0].hex() == merkle_root
+
+
+#the first leaf_count leaves split into the perfect subtrees a streaming
+#build keeps on its stack, largest first, as (level, index). each one is a
+#node of every tree that starts with those leaves
+def frontier_nodes(leaf_count):
+    nodes = []
+    start = 0
+    for level in range(leaf_count.bit_length() - 1, -1, -1):
+        if leaf_count >> level & 1:
+            nodes.append((level, start >> level))
+            start += 1 << level
+    return nodes
+
+#proof that a tree's first old_count leaves are exactly the leaves of an
+#older tree: the old frontier nodes plus a multiproof of them in this tree
+def generate_consistency_proof(tree, old_count):
+    if not 0 < old_count <= tree.leaf_count:
+        raise ValueError(f"old leaf count {old_count} out of range")
+    frontier = frontier_nodes(old_count)
+    targets = {}
+    for level, index in frontier:
+        targets.setdefault(level, []).append(index)
+    proof = generate_multiproof(tree, targets)
+    proof["old_count"] = old_count
+    proof["frontier"] = [(level, index, tree.node(level, index).hex()) for level, index in frontier]
+    return proof
 
-def save_root(root, filename="saved_root.txt"):
+#the frontier must fold to the old root and, with the multiproof nodes,
+#hash up to the new root
+def verify_consistency_proof(old_root, new_root, proof):
+    frontier = proof["frontier"]
+    if [(level, index) for level, index, _ in frontier] != frontier_nodes(proof["old_count"]):
+        return False
+    builder = StreamingMerkleBuilder.from_checkpoint(
+        {"leaves": proof["old_count"], "stack": [[level, digest] for level, _, digest in frontier]},
+        proof.get("mode", "hex")
+    )
+    if builder.root != old_root:
+        return False
+    return verify_multiproof({(level, index): digest for level, index, digest in frontier}, proof, new_root)
+
+#the root is saved with the hash mode it was built with, since a root is
+#only comparable with trees hashed the same way
+def save_root(root, filename="saved_root.txt", mode="hex"):
+    backend = hash_backend(mode)
     with open(filename, "w") as f:
-        f.write(root)
+        json.dump({"root": root, "mode": mode, "algorithm": backend.algorithm,
+                   "digest_size": backend.digest_size,
+                   "leaf_encoding_version": LEAF_ENCODING_VERSION}, f, indent=2)
     print(f"\nMerkle Root saved to {filename}")
 
-def load_root(filename="saved_root.txt"):
+#root file contents as a dict; older root files hold only the hex root,
+#which was always a "hex" mode SHA-256 root
+def load_root_metadata(filename="saved_root.txt"):
     try:
         with open(filename, "r") as f:
-            return f.read().strip()
+            text = f.read().strip()
     except FileNotFoundError:
         print("\nNo saved root found.")
         return None
+    if not text.startswith("{"):
+        return {"root": text, "mode": "hex", "algorithm": "sha256", "digest_size": DIGEST_SIZE}
+    return json.loads(text)
+
+def load_root(filename="saved_root.txt"):
+    metadata = load_root_metadata(filename)
+    return metadata["root"] if metadata else None
+
+#sha256 of a file's first `size` bytes, returned unfinished so an append
+#can keep feeding it the bytes after them
+def prefix_sha256(path, size):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        remaining = size
+        while remaining > 0:
+            block = f.read(min(1 << 20, remaining))
+            if not block:
+                break
+            h.update(block)
+            remaining -= len(block)
+    return h
+
+#size, mtime and sha256 of the dataset a tree was built from
+def source_fingerprint(path, checksum=True):
+    stat = os.stat(path)
+    digest = prefix_sha256(path, stat.st_size).digest() if checksum else b""
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns,
+            "source_checksum": digest, "checksum_size": stat.st_size if checksum else 0}
+
+#digest of the first and last MiB of a file's first `size` bytes: a cheap
+#check, without rereading the whole file, that the data a tree was built
+#from still ends where the tree's build stopped
+SOURCE_ENDS_BLOCK = 1 << 20
+
+def source_ends_digest(path, size):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        h.update(f.read(min(size, SOURCE_ENDS_BLOCK)))
+        f.seek(max(0, size - SOURCE_ENDS_BLOCK))
+        h.update(f.read(min(size, SOURCE_ENDS_BLOCK)))
+    return h.digest()[:16]
+
+#layer sizes are fully determined by the leaf count
+def layer_sizes(leaf_count):
+    sizes = [leaf_count]
+    while sizes[-1] > 1:
+        sizes.append((sizes[-1] + 1) // 2)
+    return sizes
+
+#write the whole tree to a binary file; written to a temp file and renamed
+#so readers never see a half-written tree. checksum=False skips rereading
+#the whole source for its sha256 (after an append, say) and keeps the
+#tree's existing checksum, which then covers only the first checksum_size
+#bytes; a full save, or an append with verify_prefix, covers all of them again
+def save_tree(tree, filename="merkle_tree.bin", source_path=None, checksum=True):
+    metadata = dict(tree.metadata)
+    if source_path:
+        fingerprint = source_fingerprint(source_path, checksum)
+        if not checksum and metadata.get("source_checksum"):
+            del fingerprint["source_checksum"], fingerprint["checksum_size"]
+        metadata.update(fingerprint)
+        metadata["source_ends"] = source_ends_digest(source_path, metadata["source_size"])
+    metadata.setdefault("leaf_encoding_version", LEAF_ENCODING_VERSION)
+#the algorithm field holds the full mode for the prefixed backends; the
+#mode field keeps "hex" or "raw" for the original SHA-256 trees
+    backend = hash_backend(tree.mode)
+    if len(backend.algorithm) > 16:
+        raise ValueError(f"hash mode {tree.mode!r} is too long for the tree header")
+    metadata["algorithm"] = backend.algorithm
+    header = TREE_HEADER.pack(
+        TREE_MAGIC, TREE_FORMAT_VERSION, metadata["leaf_encoding_version"],
+        backend.algorithm.encode("ascii"), (tree.mode if not backend.node_prefix else "prefix").encode("ascii"),
+        tree.leaf_count,
+        metadata.get("source_size", 0), metadata.get("source_mtime_ns", 0),
+        metadata.get("source_checksum", b""),
+        metadata.get("source_offset") or 0, metadata.get("source_lines") or 0,
+        metadata.get("source_ends") or b"",
+        metadata.get("checksum_size") or 0
+    )
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header.ljust(TREE_HEADER_SIZE, b"\0"))
+        for layer in tree.layers:
+            f.write(layer)
+    os.replace(tmp, filename)
+    tree.metadata = metadata
+    print(f"\nMerkle Tree saved to {filename}")
+
+#map a saved tree file; layers are views into the mapping so nothing is
+#rehashed and processes opening the same file share its pages.
+#ACCESS_COPY lets incremental updates run in memory without touching the file
+def load_tree(filename="merkle_tree.bin"):
+    with open(filename, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    (magic, version, leaf_version, algorithm, mode, leaf_count, source_size,
+     source_mtime_ns, checksum, source_offset, source_lines, source_ends,
+     checksum_size) = TREE_HEADER.unpack_from(mapped)
+    if magic != TREE_MAGIC:
+        raise ValueError(f"{filename} is not a Merkle tree file")
+#older headers end before the later fields, which read as zero padding
+    if version not in (1, 2, 3, TREE_FORMAT_VERSION):
+        raise ValueError(f"unsupported tree file version {version}")
+    header_size = TREE_HEADER_SIZE
+    if version < 4:
+        header_size = LEGACY_TREE_HEADER_SIZE
+        checksum_size = source_size
+    algorithm = algorithm.rstrip(b"\0").decode("ascii")
+    mode = mode.rstrip(b"\0").decode("ascii")
+    if mode not in ("hex", "raw"):
+        mode = algorithm
+    digest_size = hash_backend(mode).digest_size
+    sizes = layer_sizes(leaf_count)
+    expected = header_size + sum(sizes) * digest_size
+    if len(mapped) != expected:
+        raise ValueError(f"{filename} is truncated ({len(mapped)} of {expected} bytes)")
+    view = memoryview(mapped)
+    layers = []
+    offset = header_size
+    for size in sizes:
+        layers.append(view[offset:offset + size * digest_size])
+        offset += size * digest_size
+    tree = MerkleTree(layers, mode)
+    tree.metadata = {
+        "leaf_encoding_version": leaf_version,
+        "algorithm": algorithm,
+        "source_size": source_size,
+        "source_mtime_ns": source_mtime_ns,
+#all zero when the tree was saved without them
+        "source_checksum": checksum if checksum.strip(b"\0") else b"",
+        "checksum_size": checksum_size if checksum.strip(b"\0") else 0,
+        "source_offset": source_offset if source_lines else None,
+        "source_lines": source_lines or None,
+        "source_ends": source_ends if source_ends.strip(b"\0") else None,
+    }
+    tree.mmap = mapped
+    return tree
+
+#append mode: hash only the records added after the point the tree was
+#built to, extend its right spine and check the old leaves are unchanged
+#with a consistency proof, so k new records cost O(k log n) and not a pass
+#over the file. appends leave the dataset's first source_size bytes alone
+#(also true of gzip, where each append is a new member); the first and last
+#MiB of them are compared with the tree's digest. verify_prefix also rereads
+#the checksum_size bytes the saved sha256 covers, then extends it over the
+#rest of the file so the next save covers everything. old_root is the root the
+#appended tree must be consistent with, normally the saved root; by default
+#the tree's own root before the append. returns the proof; save the tree
+#with source_path (checksum=False keeps the save O(k) in hashing) afterwards
+#to record the new end point. offsets, an array("Q"), gets the new leaves'
+#record offsets appended
+def append_to_tree(tree, path, limit=None, verify_prefix=False, offsets=None, old_root=None):
+    offset = tree.metadata.get("source_offset")
+    lines = tree.metadata.get("source_lines")
+    if offset is None or lines is None:
+        raise ValueError("tree does not record where its build stopped; rebuild it before appending")
+    size = tree.metadata.get("source_size")
+    if size and os.path.getsize(path) < size:
+        raise ValueError(f"{path} is shorter than when the tree was built")
+    ends = tree.metadata.get("source_ends")
+    if size and ends and source_ends_digest(path, size) != ends:
+        raise ValueError(f"the first {size:,} bytes of {path} changed; rebuild instead of appending")
+    checksum = tree.metadata.get("source_checksum")
+    if verify_prefix and size:
+        if not checksum:
+            raise ValueError("tree was saved without a source checksum; save it with checksum=True")
+        covered = tree.metadata.get("checksum_size") or size
+        h = prefix_sha256(path, covered)
+        if h.digest() != checksum:
+            raise ValueError(f"the first {covered:,} bytes of {path} changed; rebuild instead of appending")
+#the tree's own root is its frontier folded up, so a stale old_root is
+#caught here, before the tree, its metadata or offsets are touched
+    if old_root is not None and old_root != tree.root:
+        raise ValueError("tree does not match the old root; rebuild instead of appending")
+    start = time.perf_counter()
+    old_root, old_count = tree.root, tree.leaf_count
+    new_leaves = bytearray()
+    new_offsets = array.array("Q")
+    remaining = (limit if limit is not None else 1 << 62) - lines
+    for batch in iter_line_batches(path, remaining, start=offset):
+        digests, skipped = hash_lines(batch, lines, mode=tree.mode)
+        new_leaves += digests
+        if offsets is not None:
+            new_offsets.extend(leaf_offsets(batch, offset, skipped))
+        lines += len(batch)
+        offset += sum(map(len, batch))
+    tree.append_leaves(new_leaves)
+    proof = generate_consistency_proof(tree, old_count)
+    consistent = verify_consistency_proof(old_root, tree.root, proof)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"\nAppended {len(new_leaves) // tree.digest_size:,} leaves to {old_count:,} in {elapsed_ms:.2f} ms")
+    print("New Root:", tree.root)
+    print("Consistency with the old root:", "VALID" if consistent else "INVALID")
+    if not consistent:
+        raise ValueError("appended tree is not consistent with the old root")
+    tree.metadata.update(source_offset=offset, source_lines=lines)
+    if offsets is not None:
+        offsets.extend(new_offsets)
+    if verify_prefix and size:
+        file_size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            f.seek(covered)
+            remaining = file_size - covered
+            for block in iter(lambda: f.read(min(1 << 20, remaining)), b""):
+                h.update(block)
+                remaining -= len(block)
+        tree.metadata.update(source_checksum=h.digest(), checksum_size=file_size)
+    return proof
+
+def save_offset_index(offsets, filename="merkle_tree.idx", source_path=None):
+    fingerprint = source_fingerprint(source_path, checksum=False) if source_path else {}
+    data = array.array("Q", offsets)
+    if sys.byteorder == "big":
+        data.byteswap()
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(data), fingerprint.get("source_size", 0),
+                                  fingerprint.get("source_mtime_ns", 0)))
+        f.write(data)
+    os.replace(tmp, filename)
+    print(f"Record index saved to {filename}")
+
+#random access to the records behind the leaves: the offset index is mapped,
+#so opening it and reading any record is a seek, not a scan of the dataset.
+#compressed datasets work too, but each seek decompresses up to the offset
+class RecordIndex:
+    def __init__(self, filename="merkle_tree.idx", path=None):
+        with open(filename, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, source_size, source_mtime_ns = INDEX_HEADER.unpack_from(self.mmap)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{filename} is not a record index")
+        if len(self.mmap) != INDEX_HEADER.size + count * 8:
+            raise ValueError(f"{filename} is truncated")
+        self.leaf_count = count
+        self.metadata = {"source_size": source_size, "source_mtime_ns": source_mtime_ns}
+        self.view = memoryview(self.mmap)[INDEX_HEADER.size:]
+#on little-endian machines the mapped bytes are read as uint64 directly
+        self.offsets = self.view.cast("Q") if sys.byteorder == "little" else None
+        self.path = path
+        self.file = open_dataset(path, "rb") if path else None
+#checked like the tree file: offsets saved for another version of the
+#dataset seek to the wrong bytes
+        self.stale = bool(path and source_size) and not tree_matches_source(self, path)
+        if self.stale:
+            print(f"Warning: {path} changed since {filename} was saved; records may be read at wrong offsets.")
+
+    def offset(self, index):
+        if not 0 <= index < self.leaf_count:
+            raise IndexError(f"leaf index {index} out of range")
+        if self.offsets is not None:
+            return self.offsets[index]
+        return struct.unpack_from("<Q", self.view, index * 8)[0]
+
+    def line(self, index):
+        self.file.seek(self.offset(index))
+        return self.file.readline()
+
+    def record(self, index):
+        return json.loads(self.line(index))
+
+#`count` records from leaf `start` on, as (leaf index, record) pairs; lines
+#between them that had no leaf are skipped by seeking past them
+    def page(self, start, count):
+        rows = []
+        for index in range(start, min(start + count, self.leaf_count)):
+            offset = self.offset(index)
+            if self.file.tell() != offset:
+                self.file.seek(offset)
+            rows.append((index, json.loads(self.file.readline())))
+        return rows
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        if self.offsets is not None:
+            self.offsets.release()
+        self.view.release()
+        self.mmap.close()
+
+#short description of the record behind a leaf
+def print_record(index, data):
+    text = data.get("reviewText", "")
+    short = (text[:70] + "...") if len(text) > 70 else text
+    review_id = data.get("reviewID") or data.get("reviewerID") or data.get("id") or "-"
+    print(f"Record {index:,}: id {review_id}, asin {data.get('asin', '')}, "
+          f"rating {data.get('overall', '')}: {short}")
+
+#statistical spot check: rehash `samples` seeded random records read through
+#the offset index, compare them with the tree's leaves and prove those leaves
+#against the root with one multiproof, so the cost grows with samples * log n
+#instead of the dataset size. if a fraction f of the records were changed,
+#all k samples pass with probability at most (1 - f)^k, so a clean audit
+#bounds f below 1 - (1 - confidence)^(1/k) at the given confidence.
+#root defaults to the tree's own root; pass the saved root to also catch a
+#tree file that no longer matches it
+def sample_audit(tree, index, samples=1000, seed=None, confidence=0.95, root=None):
+    if samples < 1:
+        raise ValueError("an audit needs at least one sample")
+    if index.leaf_count != tree.leaf_count:
+        raise ValueError(f"record index has {index.leaf_count:,} records but the tree has "
+                         f"{tree.leaf_count:,} leaves")
+    if seed is None:
+        seed = random.randrange(1 << 32)
+    start = time.perf_counter()
+    count = min(samples, tree.leaf_count)
+#sorted so the dataset is read front to back
+    positions = sorted(random.Random(seed).sample(range(tree.leaf_count), count))
+#a build that skipped invalid lines leaves no line numbers to rehash
+#records without an id at, so those are reported as unchecked
+    lines = tree.metadata.get("source_lines")
+    line_known = not lines or lines == tree.leaf_count
+    failed = []
+    unchecked = []
+    for i in positions:
+        try:
+            data = json.loads(index.line(i))
+        except ValueError:
+            failed.append(i)
+            continue
+        if not line_known and not (data.get("reviewID") or data.get("reviewerID") or data.get("id")):
+            unchecked.append(i)
+            continue
+        if leaf_digest(data, i, tree.mode) != tree.node(0, i):
+            failed.append(i)
+    multiproof = generate_multiproof(tree, positions)
+    tree_valid = verify_multiproof({i: tree.leaf(i) for i in positions}, multiproof, root or tree.root)
+    seconds = time.perf_counter() - start
+    METRICS.add_time("audit", seconds, count)
+    checked = count - len(unchecked)
+    if checked == tree.leaf_count:
+        bound = 0.0
+    else:
+        bound = 1 - (1 - confidence) ** (1 / checked) if checked else 1.0
+    return {
+        "samples": count,
+        "seed": seed,
+        "checked": checked,
+        "failed": failed,
+        "unchecked": unchecked,
+        "tree_valid": tree_valid,
+        "intact": not failed and tree_valid,
+        "confidence": confidence,
+#only meaningful when intact: the changed fraction is below this
+        "max_tampered_fraction": bound,
+        "proof_nodes": len(multiproof["nodes"]),
+        "seconds": seconds,
+        "index_stale": getattr(index, "stale", False),
+    }
+
+def print_audit(audit):
+    print(f"\nAudited {audit['samples']:,} records (seed {audit['seed']}) in {audit['seconds'] * 1000:.2f} ms")
+    print(f"Proof nodes: {audit['proof_nodes']:,}")
+    if audit["unchecked"]:
+        print(f"Unchecked: {len(audit['unchecked']):,} records without an id after skipped lines")
+    if audit.get("index_stale"):
+        print("The record index is older than the dataset, so changed records may be misread offsets.")
+    if not audit["tree_valid"]:
+        print("Tree leaves do not prove against the root.")
+    if audit["failed"]:
+        shown = ", ".join(str(i) for i in audit["failed"][:20])
+        more = f" (+{len(audit['failed']) - 20:,} more)" if len(audit["failed"]) > 20 else ""
+        print(f"Changed records: {len(audit['failed']):,} of {audit['checked']:,} sampled: {shown}{more}")
+    if audit["intact"]:
+        print(f"\nSAMPLE INTACT: with {audit['confidence']:.0%} confidence fewer than "
+              f"{audit['max_tampered_fraction']:.4%} of records were changed")
+    else:
+        print("\nTAMPERING DETECTED")
+
+#does a loaded tree still describe this dataset file?
+#the quick check compares size and mtime; checksum=True also rereads the
+#bytes the saved sha256 covers, all of them after a full save
+def tree_matches_source(tree, path, checksum=False):
+    current = source_fingerprint(path, checksum=False)
+    if any(tree.metadata.get(k) != current[k] for k in ("source_size", "source_mtime_ns")):
+        return False
+    if not checksum:
+        return True
+    saved = tree.metadata.get("source_checksum")
+    return bool(saved) and prefix_sha256(path, tree.metadata["checksum_size"]).digest() == saved
 
 def tamper_menu():
     print("\nTamper Options:")
     print("1. Modify Review #10")
     print("2. Delete Review #10")
     print("3. Insert Fake Review")
+    print("4. Random Seeded Tampering")
     print("0. Cancel")
     return input("Choose tamper type: ")
 
@@ -265,11 +1815,22 @@ def tamper_insert(lines):
     lines.insert(5, json.dumps(fake) + "\n")
     print("Inserted fake review at index #5")
 
-def tamper_dataset(original_path, tampered_path="tampered.json"):
+#total, the number of lines the current tree was built from, lets seeded
+#tampering run in a single pass over the dataset (see tamper_stream)
+def tamper_dataset(original_path, tampered_path="tampered.json", total=None):
     print("\nSimulating tampering...")
+    option = tamper_menu()
+    if option == "4":
+        counts = [int(input(f"Number of {kind}: ") or 0) for kind in ("modifications", "deletions", "insertions")]
+        seed = int(input("Seed: ") or 0)
+        try:
+            tamper_stream(original_path, tampered_path, *counts, seed=seed, total=total)
+        except ValueError as exc:
+            print(f"Cannot tamper: {exc}")
+            return None
+        return tampered_path
     with open(original_path, "r", encoding="utf-8") as f:
         lines = f.readlines()
-    option = tamper_menu()
     if option == "1":
         tamper_modify(lines)
     elif option == "2":
@@ -284,17 +1845,141 @@ def tamper_dataset(original_path, tampered_path="tampered.json"):
     print("Tampered dataset saved as tampered.json")
     return tampered_path
 
-def measure_hashing_speed(path, limit=300_000):
+#lines in a dataset, plain or compressed, counted in blocks
+def count_dataset_lines(path):
+    count = 0
+    last = b""
+    with open_dataset(path, "rb") as f:
+        while True:
+            block = f.read(1 << 24)
+            if not block:
+                break
+            count += block.count(b"\n")
+            last = block
+    return count + (1 if last and not last.endswith(b"\n") else 0)
+
+#a fake review with its own key, so alignment reports it as an insertion
+def fake_review(rng, number):
+    return {
+        "reviewerID": f"FAKE{number:09d}",
+        "asin": "FAKE",
+        "overall": float(rng.randint(1, 5)),
+        "reviewText": f"THIS IS A FAKE REVIEW! #{number}"
+    }
+
+#non-interactive tampering for detection benchmarks. picks `modify` and
+#`delete` distinct lines and `insert` insertion points with a seeded rng,
+#then copies the dataset in one streaming pass, so memory grows with the
+#number of edits and not with the file. the picks need the line count up
+#front: pass it as `total` (the tree's source_lines, or the --records of a
+#generated file) for a single pass; without it the dataset is read once
+#more just to count lines. only the first `total` lines are copied, and a
+#file shorter than `total` raises ValueError. the manifest has the same shape as
+#align_records(): modified (original, tampered) pairs, inserted tampered
+#positions and deleted original positions. positions are line numbers, which
+#equal record positions when every line parses
+def tamper_stream(original_path, tampered_path="tampered.json", modify=0, delete=0, insert=0,
+                  seed=0, manifest_path=None, total=None):
+    if total is None:
+        print("Counting records first; pass total= to tamper in a single pass.")
+        total = count_dataset_lines(original_path)
+    if modify + delete > total:
+        raise ValueError(f"cannot modify and delete {modify + delete:,} of {total:,} records")
+    rng = random.Random(seed)
+    chosen = rng.sample(range(total), modify + delete)
+    modified_lines = set(chosen[:modify])
+    deleted_lines = set(chosen[modify:])
+#insertion points are original line numbers; total means the end of the file
+    insert_points = sorted(rng.randrange(total + 1) for _ in range(insert))
+    manifest = {"modified": [], "inserted": [], "deleted": sorted(deleted_lines)}
+
+    start = time.perf_counter()
+    out = 0
+    pending = 0
+    lines_read = 0
+    with open_dataset(original_path, "rb") as src, open(tampered_path, "wb") as dst:
+        def write_inserts(before):
+            nonlocal out, pending
+            while pending < len(insert_points) and insert_points[pending] == before:
+                dst.write(json.dumps(fake_review(rng, pending)).encode("utf-8") + b"\n")
+                manifest["inserted"].append(out)
+                out += 1
+                pending += 1
+
+        for idx, line in enumerate(src):
+            if idx == total:
+                break
+            lines_read += 1
+            write_inserts(idx)
+            if idx in deleted_lines:
+                continue
+            if idx in modified_lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = {}
+                record["reviewText"] = f"THIS REVIEW HAS BEEN MODIFIED! #{idx}"
+                line = json.dumps(record).encode("utf-8")
+                manifest["modified"].append((idx, out))
+            dst.write(line if line.endswith(b"\n") else line + b"\n")
+            out += 1
+        if lines_read < total:
+            raise ValueError(f"{original_path} has {lines_read:,} lines, not {total:,}")
+        write_inserts(total)
+
+    manifest.update({
+        "seed": seed,
+        "original_path": original_path,
+        "tampered_path": tampered_path,
+        "original_records": total,
+        "tampered_records": out,
+    })
+    if manifest_path is None:
+        manifest_path = tampered_path + ".manifest.json"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    elapsed = time.perf_counter() - start
+    print(f"Tampered {total:,} records in {elapsed:.2f} sec: {modify:,} modified, "
+          f"{delete:,} deleted, {insert:,} inserted")
+    print(f"Tampered dataset saved as {tampered_path}, ground truth in {manifest_path}")
+    return manifest
+
+def load_manifest(manifest_path):
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["modified"] = [tuple(pair) for pair in manifest["modified"]]
+    return manifest
+
+#compare an align_records() result with a tamper manifest, per edit kind
+def score_detection(manifest, detected):
+    scores = {}
+    for kind in ("modified", "inserted", "deleted"):
+        expected = {tuple(i) if isinstance(i, list) else i for i in manifest[kind]}
+        found = {tuple(i) if isinstance(i, list) else i for i in detected[kind]}
+        hits = len(expected & found)
+        scores[kind] = {
+            "expected": len(expected),
+            "found": len(found),
+            "missed": len(expected - found),
+            "false_positives": len(found - expected),
+            "precision": hits / len(found) if found else 1.0,
+            "recall": hits / len(expected) if expected else 1.0,
+        }
+    scores["exact"] = all(s["missed"] == 0 and s["false_positives"] == 0 for s in scores.values())
+    return scores
+
+def measure_hashing_speed(path, limit=300_000, mode="hex"):
     print(f"\nMeasuring hashing speed on first {limit:,} records...")
+    backend = hash_backend(mode)
     start_time = time.time()
     count = 0
-    with open(path, "r", encoding="utf-8") as f:
+    with open_dataset(path) as f:
         for i, line in enumerate(f):
             if i == limit:
                 break
             data = json.loads(line)
             text = (data.get("reviewText", ""))
-            sha256_hash(text)
+            backend.leaf(text.encode("utf-8"))
             count += 1
     duration = time.time() - start_time
     speed = count / duration
@@ -302,32 +1987,54 @@ def measure_hashing_speed(path, limit=300_000):
     print(f"Hashing Speed: {speed:,.0f} hashes/sec\n")
     return speed, duration
 
-def measure_merkle_build_performance(leaf_hashes):
+#throughput of the canonicalization stage alone: lines are read first so
+#only parsing, field extraction and text cleaning are timed
+def measure_canonicalization_speed(path, limit=300_000):
+    print(f"\nMeasuring canonicalization speed on first {limit:,} records...")
+    batches = list(iter_line_batches(path, limit))
+    size_mb = sum(len(line) for batch in batches for line in batch) / (1024 * 1024)
+    start_time = time.time()
+    count = 0
+    for batch in batches:
+        encoded, _ = canonicalize_lines(batch)
+        count += len(encoded)
+    duration = time.time() - start_time
+    speed = count / duration if duration else 0.0
+    print(f"Canonicalized {count:,} reviews in {duration:.2f}s")
+    print(f"Canonicalization Speed: {speed:,.0f} records/sec ({size_mb / duration if duration else 0:,.1f} MB/sec)\n")
+    return speed, duration
+
+def measure_merkle_build_performance(leaf_hashes, workers=1, mode="hex"):
     print("\nMeasuring Merkle Tree build performance...")
     tracemalloc.start()
     start_time = time.time()
-    root = build_merkle_root(leaf_hashes)
+    tree = build_merkle_tree(leaf_hashes, workers=workers, mode=mode)
     duration = time.time() - start_time
     current, peak = tracemalloc.get_traced_memory()
     tracemalloc.stop()
     peak_mb = peak / (1024 * 1024)
     print(f"\nMerkle Build Time: {duration:.2f} sec")
     print(f"Peak Memory Usage: {peak_mb:.2f} MB")
-    return root, duration, peak_mb
+    return tree, duration, peak_mb
 
-def measure_proof_generation(leaf_hashes, index):
-    print("\nMeasuring proof generation time at index 500...")
+def measure_proof_generation(tree, index):
+    print(f"\nMeasuring proof generation time at index {index}...")
     start = time.time()
-    proof = generate_proof(index, leaf_hashes)
+    proof = generate_proof(index, tree)
     duration = (time.time() - start) * 1000
     print(f"Proof Generation Time: {duration:.2f} ms")
     return proof, duration
 
-def performance_report(hash_speed, hash_time, build_time, peak_mem, proof_time):
+def performance_report(hash_speed, hash_time, build_time, peak_mem, proof_time, phase_times=None,
+                       canon_speed=None):
     print("        PERFORMANCE SUMMARY REPORT")
     print(f"Hashing Speed:         {hash_speed:,.0f} hashes/sec")
     print(f"Hashing Time:          {hash_time:.2f} sec")
+    if canon_speed is not None:
+        print(f"Canonicalization:      {canon_speed:,.0f} records/sec")
     print(f"Merkle Build Time:     {build_time:.2f} sec")
+    for phase, seconds in (phase_times or {}).items():
+        print(f"  {phase + ':':<21}{seconds:.2f} sec")
     print(f"Peak Memory Usage:     {peak_mem:.2f} MB")
     print(f"Proof Generation Time: {proof_time:.2f} ms")
     print("============================================\n")
@@ -356,6 +2063,17 @@ def run_test_suite():
         "Checking that sha256_hash of abc matches Python's hashlib output.",
         sha256_hash("abc") == hashlib.sha256("abc".encode()).hexdigest()
     )
+    run_test(
+        "Text Canonicalization",
+        "clean_text should strip tags, apply NFKC, collapse whitespace and lowercase.",
+        clean_text("  <b>Ｈｉ</b>\tThere \n") == "hi there" and clean_text("Plain  ASCII") == "plain ascii"
+    )
+    anonymous = {"asin": "fake", "overall": 1, "reviewText": "THIS IS A FAKE REVIEW!"}
+    run_test(
+        "Deterministic Leaf Identity",
+        "A review without an id should hash the same on every run and differ by line.",
+        leaf_string(anonymous, 5) == leaf_string(anonymous, 5) != leaf_string(anonymous, 6)
+    )
 #dummy reviews for testing
     dummy_reviews = ["hello", "world"]
     dummy_leafs = [sha256_hash(f"R{i}|||{txt}") for i, txt in enumerate(dummy_reviews)]
@@ -395,6 +2113,377 @@ def run_test_suite():
         valid
     )
 
+    odd_leafs = [sha256_hash(f"R{i}|||odd") for i in range(5)]
+    odd_tree = build_merkle_tree(odd_leafs, verbose=False)
+    run_test(
+        "Stored Tree Proofs (odd leaf count)",
+        "Every proof read from a 5-leaf stored tree should verify against its root.",
+        odd_tree.root == build_merkle_root(odd_leafs) and all(
+            verify_proof(odd_leafs[i], odd_tree.proof(i), odd_tree.root) for i in range(5)
+        )
+    )
+
+    raw_tree = build_merkle_tree(odd_leafs, verbose=False, mode="raw")
+    run_test(
+        "Raw Digest Mode",
+        "Raw mode should give a different root whose proofs still verify in raw mode.",
+        raw_tree.root != odd_tree.root and
+        verify_proof(odd_leafs[3], raw_tree.proof(3), raw_tree.root, mode="raw")
+    )
+
+    updated_leafs = odd_leafs.copy()
+    updated_leafs[1] = updated_leafs[4] = sha256_hash("changed")
+    batch_tree = build_merkle_tree(odd_leafs, verbose=False)
+    run_test(
+        "Incremental Batch Update",
+        "Updating 2 leaves in place should give the same root as a full rebuild.",
+        batch_tree.update_leaves([(1, updated_leafs[1]), (4, updated_leafs[4])])
+        == build_merkle_root(updated_leafs)
+    )
+
+    stream_leafs = [sha256_hash(f"S{i}") for i in range(17)]
+    run_test(
+        "Streaming Root Builder",
+        "Streaming roots for 1 to 17 leaves should match the layer-by-layer roots.",
+        all(stream_merkle_root(stream_leafs[:n]) ==
+            build_merkle_tree(stream_leafs[:n], verbose=False).root for n in range(1, 18))
+    )
+
+#grow a tree from old_count to new_count leaves and check it against a full build
+    def append_consistent(old_count, new_count, old_root=None):
+        tree = build_merkle_tree(stream_leafs[:old_count], verbose=False)
+        old_root = old_root or tree.root
+        tree.append_leaves(pack_hashes(stream_leafs[old_count:new_count]))
+        proof = generate_consistency_proof(tree, old_count)
+        return (tree.root == build_merkle_tree(stream_leafs[:new_count], verbose=False).root
+                and verify_consistency_proof(old_root, tree.root, proof))
+    run_test(
+        "Append and Consistency Proof",
+        "Appending leaves should give the full-build root and a proof tying it to the old root.",
+        all(append_consistent(a, b) for b in range(1, 18) for a in range(1, b + 1))
+        and not append_consistent(4, 9, old_root=stream_merkle_root(stream_leafs[1:5]))
+    )
+
+#leaf counts just below, on and above the 8-leaf blocks of subtree_levels=3
+    def sharded_matches(count):
+        leaves = pack_hashes([sha256_hash(f"P{i}") for i in range(count)])
+        serial = build_merkle_tree(bytearray(leaves), verbose=False).layers
+        sharded = build_merkle_tree(bytearray(leaves), verbose=False, workers=2, subtree_levels=3).layers
+        return [bytes(layer) for layer in serial] == [bytes(layer) for layer in sharded]
+    run_test(
+        "Parallel Subtree Build",
+        "Sharded builds over 7 to 2049 leaves should give byte-identical layers to the serial build.",
+        all(sharded_matches(count) for count in (7, 8, 9, 17, 1023, 1025, 2047, 2049))
+    )
+
+    run_test(
+        "Top-Down Tree Diff",
+        "Diffing against the 2-leaf-updated tree should report exactly leaves 1 and 4.",
+        diff_trees(odd_tree, batch_tree) == [1, 4]
+    )
+
+    multiproof = generate_multiproof(odd_tree, [0, 1, 4])
+    run_test(
+        "Multiproof Verification",
+        "A multiproof for leaves 0, 1 and 4 should verify and fail for a wrong leaf.",
+        verify_multiproof({0: odd_leafs[0], 1: odd_leafs[1], 4: odd_leafs[4]}, multiproof, odd_tree.root)
+        and not verify_multiproof({0: odd_leafs[0], 1: odd_leafs[2], 4: odd_leafs[4]}, multiproof, odd_tree.root)
+    )
+
+#leaf 5 is past the right edge of the 5-leaf layer, where nothing would hash it
+    edge_proof = generate_multiproof(odd_tree, [4])
+    run_test(
+        "Multiproof Out-of-Range Leaf",
+        "An extra leaf past the last index, or a leaf the proof was not generated for, should fail.",
+        verify_multiproof({4: odd_leafs[4]}, edge_proof, odd_tree.root)
+        and not verify_multiproof({4: odd_leafs[4], 5: "00" * 32}, edge_proof, odd_tree.root)
+        and not verify_multiproof({3: odd_leafs[3], 4: odd_leafs[4]}, edge_proof, odd_tree.root)
+    )
+
+#the proof server's response shape, sent through JSON
+    response = json.loads(json.dumps(dict(multiproof, leaves=[[i, odd_leafs[i]] for i in (0, 1, 4)])))
+    run_test(
+        "Multiproof JSON Round Trip",
+        "A multiproof and its leaves should still verify after json.dumps and json.loads.",
+        verify_multiproof(response["leaves"], response, odd_tree.root)
+        and verify_multiproof({str(i): leaf for i, leaf in response["leaves"]}, response, odd_tree.root)
+    )
+
+    batch = [(odd_leafs[i], odd_tree.proof(i)) for i in range(5)] + [(odd_leafs[0], odd_tree.proof(1))]
+    batch_results, batch_stats = verify_proofs_batch(batch, odd_tree.root)
+    verify_calls = METRICS.timers.get("verify", [0])[0]
+    pool_results, _ = verify_proofs_batch(batch, odd_tree.root, workers=2, chunk_size=2)
+    run_test(
+        "Batch Proof Verification",
+        "Bulk verification of 6 proofs should flag only the mismatched last pair, serially and in a "
+        "pool whose workers' verify timings reach the parent's metrics.",
+        list(batch_results) == [1, 1, 1, 1, 1, 0] and batch_stats["invalid"] == 1
+        and pool_results == batch_results and METRICS.timers["verify"][0] == verify_calls + 6
+    )
+
+    set_results, _ = verify_proofs_batch({4: odd_leafs[4]}, odd_tree.root, multiproof=edge_proof)
+    try:
+        verify_proofs_batch({4: odd_leafs[4], 5: "00" * 32}, odd_tree.root, multiproof=edge_proof)
+        extra_rejected = False
+    except ValueError:
+        extra_rejected = True
+    run_test(
+        "Batch Multiproof Verification",
+        "A multiproof batch should give one shared result and reject leaves the proof was not made for.",
+        list(set_results) == [1] and extra_rejected
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tree_file = os.path.join(tmp, "tree.bin")
+        save_tree(odd_tree, tree_file)
+        mapped_tree = load_tree(tree_file)
+        run_test(
+            "Tree File Round Trip",
+            "A saved and memory-mapped tree should give the same root and proofs.",
+            mapped_tree.root == odd_tree.root and mapped_tree.proof(4) == odd_tree.proof(4)
+        )
+        del mapped_tree
+
+#records without an id every fifth line and one undecodable line, so line
+#numbers and skipped lines both matter; the limit lands inside a range
+        mixed_file = os.path.join(tmp, "mixed.json")
+        with open(mixed_file, "w", encoding="utf-8") as f:
+            for i in range(40):
+                record = {"asin": "B", "overall": i % 5, "reviewText": f"review {i}"}
+                if i % 5:
+                    record["reviewerID"] = f"M{i}"
+                f.write("{broken\n" if i == 13 else json.dumps(record) + "\n")
+        serial_offsets, parallel_offsets = array.array("Q"), array.array("Q")
+        serial_progress, parallel_progress = {}, {}
+        serial_leaves = build_leaf_hashes(mixed_file, 23, packed=True, offsets=serial_offsets,
+                                          progress=serial_progress)
+        parallel_leaves = build_leaf_hashes(mixed_file, 23, packed=True, workers=2, offsets=parallel_offsets,
+                                            progress=parallel_progress)
+        run_test(
+            "Parallel Leaf Hashing",
+            "workers=2 with a limit of 23 lines should give the serial leaves, offsets and end point.",
+            parallel_leaves == serial_leaves and len(serial_leaves) == 22 * DIGEST_SIZE
+            and parallel_offsets == serial_offsets and parallel_progress == serial_progress
+        )
+
+        with open(mixed_file, "rb") as f:
+            mixed_lines = f.readlines()
+        plain_offsets = array.array("Q")
+        plain_leaves = build_leaf_hashes(mixed_file, packed=True, offsets=plain_offsets)
+        same_leaves = True
+        for suffix, opener in [(".gz", gzip.open), (".bz2", bz2.open), (".xz", lzma.open)]:
+            with opener(mixed_file + suffix, "wb") as f:
+                f.writelines(mixed_lines)
+            compressed_offsets = array.array("Q")
+            compressed_leaves = build_leaf_hashes(mixed_file + suffix, packed=True, offsets=compressed_offsets)
+            same_leaves = same_leaves and compressed_leaves == plain_leaves and compressed_offsets == plain_offsets
+#resume the gzip build after line 7, which seeks the decompressed stream
+        gz_checkpoint = os.path.join(tmp, "gz_checkpoint.json")
+        state = new_checkpoint(mixed_file + ".gz", "leaves:hex", 1_500_000)
+        checkpoint_leaf_build(gz_checkpoint, state, plain_leaves[:7 * DIGEST_SIZE],
+                              sum(map(len, mixed_lines[:7])), 7, every=1)
+        resumed = build_leaf_hashes(mixed_file + ".gz", packed=True, checkpoint=gz_checkpoint)
+#a truncated stream fails in the reader thread; the error must reach the caller
+        with open(mixed_file + ".gz", "rb") as f:
+            truncated = f.read()[:-20]
+        with open(mixed_file + ".cut.gz", "wb") as f:
+            f.write(truncated)
+        try:
+            build_leaf_hashes(mixed_file + ".cut.gz", packed=True)
+            reader_error = False
+        except EOFError:
+            reader_error = True
+        run_test(
+            "Compressed Input",
+            "gzip, bz2 and xz input should give the plain file's leaves and offsets, a gzip build should "
+            "resume mid-stream, and a truncated stream should raise instead of hanging.",
+            same_leaves and resumed == plain_leaves and reader_error
+        )
+
+        reviews =[json.dumps({"reviewerID": f"R{i}", "asin": "A", "overall": 5, "reviewText": "ok"})
+                   for i in range(6)]
+        original_file = os.path.join(tmp, "original.json")
+        shifted_file = os.path.join(tmp, "shifted.json")
+        with open(original_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(reviews) + "\n")
+        with open(shifted_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(reviews[:1] + [json.dumps({"asin": "fake"})] + reviews[2:]) + "\n")
+        shifted_leaves = bytearray()
+        run_test(
+            "Key-Aligned Diff",
+            "Replacing review 1 with a fake one should be 1 insert and 1 delete, not a shift, and "
+            "hash the same tampered leaves as a full build.",
+            align_records(original_file, shifted_file, leaves=shifted_leaves) ==
+            {"modified": [], "inserted": [1], "deleted": [1]}
+            and shifted_leaves == build_leaf_hashes(shifted_file, packed=True)
+        )
+
+        modified_file = os.path.join(tmp, "modified.json")
+        with open(modified_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(reviews[:2] + [reviews[2].replace('"ok"', '"changed"')] + reviews[3:]) + "\n")
+        original_tree = build_merkle_tree(build_leaf_hashes(original_file, packed=True), verbose=False)
+        run_test(
+            "Incremental Integrity Check",
+            "Editing review 2 in place should rehash only that line and report exactly record 2.",
+            update_leaf_hashes_partial(original_file, modified_file, original_tree).keys() == {2}
+            and check_integrity_partial(original_file, modified_file, original_tree.root, original_tree) == [2]
+        )
+
+#the tampered path does not exist: a given tree must be diffed without reading it
+        modified_tree = build_merkle_tree(build_leaf_hashes(modified_file, packed=True), verbose=False)
+        shorter_file = os.path.join(tmp, "shorter.json")
+        with open(shorter_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(reviews[:1] + reviews[2:]) + "\n")
+        shorter_tree = build_merkle_tree(build_leaf_hashes(shorter_file, packed=True), verbose=False)
+        missing_file = os.path.join(tmp, "missing.json")
+        run_test(
+            "Integrity Check From Tree",
+            "A given tampered tree should be diffed from the roots without reading the tampered file, "
+            "and aligned by key when its leaf count differs.",
+            check_integrity_partial(original_file, missing_file, original_tree.root, original_tree,
+                                    tampered_tree=modified_tree) == [2]
+            and check_integrity_partial(original_file, shorter_file, original_tree.root, original_tree,
+                                        tampered_tree=shorter_tree)["deleted"] == [1]
+        )
+
+        tampered_file = os.path.join(tmp, "tampered.json")
+        manifest = tamper_stream(original_file, tampered_file, modify=1, delete=1, insert=2, seed=7,
+                                 total=len(reviews))
+        detection = score_detection(manifest, align_records(original_file, tampered_file))
+        try:
+            tamper_stream(original_file, os.path.join(tmp, "short.json"), modify=1, seed=7, total=len(reviews) + 1)
+            short_rejected = False
+        except ValueError:
+            short_rejected = True
+        run_test(
+            "Seeded Tamper Manifest",
+            "Key alignment should find exactly the edits listed in a single-pass tamper manifest, "
+            "and a total past the end of the file should be rejected.",
+            detection["exact"] and short_rejected
+        )
+
+#one delete and one insert keep the record count, so only the record keys
+#show that the records in between shifted rather than changed
+        swapped_file = os.path.join(tmp, "swapped.json")
+        swap_manifest = tamper_stream(original_file, swapped_file, delete=1, insert=1, seed=4)
+        swap_result = check_integrity_partial(original_file, swapped_file, original_tree.root, original_tree)
+        run_test(
+            "Equal-Count Insert and Delete",
+            "A delete plus an insert should be aligned by key and match the manifest, not reported as a shift.",
+            swap_manifest["tampered_records"] == len(reviews)
+            and isinstance(swap_result, dict) and score_detection(swap_manifest, swap_result)["exact"]
+        )
+
+#a checkpoint as if the build had been killed after the first two lines
+        checkpoint = os.path.join(tmp, "build_checkpoint.json")
+        full_leaves = build_leaf_hashes(original_file, packed=True)
+        state = new_checkpoint(original_file, "leaves:hex", 1_500_000)
+        checkpoint_leaf_build(checkpoint, state, full_leaves[:2 * DIGEST_SIZE],
+                              len(reviews[0]) + len(reviews[1]) + 2, 2, every=1)
+        run_test(
+            "Resumed Leaf Build",
+            "A build resumed from a checkpoint at line 2 should give the same leaves.",
+            build_leaf_hashes(original_file, packed=True, checkpoint=checkpoint) == full_leaves
+        )
+
+        offsets = array.array("Q")
+        build_leaf_hashes(original_file, packed=True, offsets=offsets)
+        index_file = os.path.join(tmp, "tree.idx")
+        save_offset_index(offsets, index_file, original_file)
+        index = RecordIndex(index_file, original_file)
+        run_test(
+            "Record Offset Index",
+            "Record 4 and a page from record 2 should be read back by seeking, not scanning.",
+            index.record(4) == json.loads(reviews[4])
+            and [data for _, data in index.page(2, 3)] == [json.loads(r) for r in reviews[2:5]]
+            and not index.stale
+        )
+
+        audit_tree = build_merkle_tree(full_leaves, verbose=False)
+        clean_audit = sample_audit(audit_tree, index, samples=3, seed=1)
+        index.close()
+#same-length edit, so the saved offsets still point at every record
+        edited_file = os.path.join(tmp, "edited.json")
+        with open(edited_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(reviews[:3] + [reviews[3].replace('"ok"', '"no"')] + reviews[4:]) + "\n")
+        index = RecordIndex(index_file, edited_file)
+        run_test(
+            "Sample Audit",
+            "A seeded audit should pass on the clean file with a tampering bound, and sampling "
+            "every record should find exactly record 3 after it is edited, through an index flagged stale.",
+            clean_audit["intact"] and clean_audit["samples"] == 3
+            and 0 < clean_audit["max_tampered_fraction"] < 1
+            and sample_audit(audit_tree, index, samples=6, seed=1)["failed"] == [3]
+            and index.stale
+        )
+        index.close()
+
+#a saved tree over the first 3 reviews, grown from the file in place
+        growing_file = os.path.join(tmp, "growing.json")
+        with open(growing_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(reviews[:3]) + "\n")
+        progress = {}
+        grown = build_merkle_tree(build_leaf_hashes(growing_file, packed=True, progress=progress), verbose=False)
+        grown.metadata.update(source_offset=progress["offset"], source_lines=progress["lines"])
+        grown_file = os.path.join(tmp, "grown.bin")
+        save_tree(grown, grown_file, source_path=growing_file)
+        saved_root = grown.root
+        with open(growing_file, "a", encoding="utf-8") as f:
+            f.write("\n".join(reviews[3:]) + "\n")
+        leaf_layer = grown.layers[0]
+        append_to_tree(grown, growing_file, old_root=saved_root)
+        reloaded = load_tree(grown_file)
+        reloaded_offsets = array.array("Q", range(3))
+        try:
+            append_to_tree(reloaded, growing_file, offsets=reloaded_offsets, old_root=audit_tree.root)
+            wrong_root_rejected = False
+        except ValueError:
+            wrong_root_rejected = (reloaded.leaf_count == 3 and len(reloaded_offsets) == 3
+                                   and reloaded.metadata["source_lines"] == 3)
+#a save after an append keeps the old checksum; a verified append extends it
+        save_tree(grown, grown_file, source_path=growing_file, checksum=False)
+        carried = load_tree(grown_file)
+        carried_ok = (tree_matches_source(carried, growing_file, checksum=True)
+                      and carried.metadata["checksum_size"] < carried.metadata["source_size"])
+        with open(growing_file, "a", encoding="utf-8") as f:
+            f.write("\n".join(reviews[:2]) + "\n")
+        append_to_tree(carried, growing_file, verify_prefix=True)
+        carried_ok = carried_ok and carried.metadata["source_checksum"] == source_fingerprint(growing_file)["source_checksum"]
+        del carried
+        with open(growing_file, "r+b") as f:
+            f.write(b"[")
+        try:
+            append_to_tree(load_tree(grown_file), growing_file)
+            prefix_rejected = False
+        except ValueError:
+            prefix_rejected = True
+        run_test(
+            "Append From File",
+            "Appending 3 reviews should extend the leaf layer in place to the full-build root, and fail "
+            "for a root the old tree never had, leaving the tree untouched, or an edited prefix. A save "
+            "after the append should keep the old checksum for a verified append to extend.",
+            grown.root == audit_tree.root and grown.layers[0] is leaf_layer
+            and wrong_root_rejected and prefix_rejected and carried_ok
+        )
+        del reloaded
+
+        blake_tree = build_merkle_tree(build_leaf_hashes(original_file, packed=True, mode="blake2b-16"),
+                                       verbose=False, mode="blake2b-16")
+        blake_file = os.path.join(tmp, "blake.bin")
+        save_tree(blake_tree, blake_file)
+        loaded_blake = load_tree(blake_file)
+        backend = hash_backend("blake2b-16")
+        run_test(
+            "Hash Backends",
+            "A BLAKE2b-16 tree should have 16-byte nodes, verify proofs, keep leaf and node hashes "
+            "apart and load back in the same mode.",
+            len(blake_tree.root_digest) == 16
+            and compute_proof_root(blake_tree.leaf(5), blake_tree.proof(5), "blake2b-16") == blake_tree.root_digest
+            and backend.leaf(b"abc") != backend.node(b"abc")
+            and (loaded_blake.mode, loaded_blake.root) == ("blake2b-16", blake_tree.root)
+        )
+        del loaded_blake
+
     altered = dummy_leafs.copy()
     altered[0] = sha256_hash("tampered")
     run_test(
@@ -412,8 +2501,14 @@ def run_test_suite():
 
 def menu():
     PATH = "Movies_and_TV_5.json"
+#hash backend for new trees, see HashBackend; "hex" keeps roots compatible
+#with trees and root files saved before the backends were added
+    MODE = "hex"
     leaf_hashes = None
+    merkle_tree = None
     merkle_root = None
+#byte offset of each leaf's record, written as merkle_tree.idx with the tree
+    record_offsets = None
 
     while True:
         print("\n====================================")
@@ -428,6 +2523,8 @@ def menu():
         print("7. Generate + Verify Proof")
         print("8. Run Performance Analysis")
         print("9. Run Test Suite")
+        print("10. Append New Records")
+        print("11. Sample Audit")
         print("0. Exit")
         print("====================================")
 
@@ -437,57 +2534,157 @@ def menu():
             view_dataset(PATH)
 
         elif choice == "2":
-            leaf_hashes = build_leaf_hashes(PATH)
-            merkle_root = build_merkle_root(leaf_hashes)
+#an interrupted build resumes from build_checkpoint.json; it is removed
+#once the tree is built
+            progress = {}
+            record_offsets = array.array("Q")
+            leaf_hashes = build_leaf_hashes(PATH, packed=True, workers=None, checkpoint="build_checkpoint.json",
+                                            progress=progress, offsets=record_offsets, mode=MODE)
+            merkle_tree = build_merkle_tree(leaf_hashes, workers=None, mode=MODE)
+            merkle_tree.metadata.update(source_offset=progress["offset"], source_lines=progress["lines"])
+            merkle_root = merkle_tree.root
+            remove_checkpoint("build_checkpoint.json")
 
         elif choice == "3":
             if merkle_root:
-                save_root(merkle_root)
+                save_root(merkle_root, mode=merkle_tree.mode)
+                save_tree(merkle_tree, source_path=PATH)
+                if record_offsets is not None:
+                    save_offset_index(record_offsets, source_path=PATH)
             else:
                 print("Build the tree first.")
 
         elif choice == "4":
-            saved = load_root()
+            saved = load_root_metadata()
             if saved:
-                print("Loaded Root:", saved)
+                print(f"Loaded Root: {saved['root']} ({saved['mode']} mode)")
+            if os.path.exists("merkle_tree.bin"):
+                merkle_tree = load_tree()
+                merkle_root = merkle_tree.root
+                record_offsets = None
+                print(f"Loaded Tree: {merkle_tree.leaf_count:,} leaves, {merkle_tree.mode} mode")
+                if saved and saved["mode"] != merkle_tree.mode:
+                    print("Warning: saved root and tree use different hash modes.")
+                if os.path.exists(PATH) and not tree_matches_source(merkle_tree, PATH):
+                    print("Warning: dataset changed since the tree was saved.")
+                if merkle_tree.metadata["leaf_encoding_version"] != LEAF_ENCODING_VERSION:
+                    print("Warning: tree uses an older leaf encoding; rebuild it before comparing.")
 
         elif choice == "5":
-            tamper_dataset(PATH)
+#the tree's line count spares tamper_stream a counting pass
+            tamper_dataset(PATH, total=merkle_tree.metadata.get("source_lines") if merkle_tree else None)
 
         elif choice == "6":
             saved_root = load_root()
             if not saved_root:
                 print("No saved root found!")
                 continue
-            check_integrity_partial(PATH, "tampered.json", saved_root, leaf_hashes)
+            if merkle_tree is None:
+                print("Build the Merkle tree first.")
+                continue
+            changed = check_integrity_partial(PATH, "tampered.json", saved_root, merkle_tree)
+#show the original records behind the first few changed leaves
+            if isinstance(changed, list) and changed and os.path.exists("merkle_tree.idx"):
+                index = RecordIndex("merkle_tree.idx", PATH)
+                for i in changed[:3]:
+                    if i < index.leaf_count:
+                        print_record(i, index.record(i))
+                index.close()
 
         elif choice == "7":
-            if leaf_hashes is None or merkle_root is None:
+            if merkle_tree is None:
                 print("Build the Merkle tree first.")
                 continue
 
-            idx = int(input("Enter review index: "))
-            target = leaf_hashes[idx]
-            proof = generate_proof(idx, leaf_hashes)
+            raw = input("Enter review index (comma-separated for a multiproof): ")
+            indices = [int(part) for part in raw.split(",") if part.strip()]
+            if not indices or not all(0 <= i < merkle_tree.leaf_count for i in indices):
+                print("Index out of range.")
+                continue
+            if len(indices) > 1:
+                multiproof = generate_multiproof(merkle_tree, indices)
+                single_nodes = len(indices) * merkle_tree.height
+                print(f"\n=== MERKLE MULTIPROOF ({len(indices)} leaves) ===")
+                print(f"Sibling nodes: {len(multiproof['nodes']):,} (separate proofs: {single_nodes:,})")
+                leaves = {i: merkle_tree.leaf(i) for i in indices}
+                valid = verify_multiproof(leaves, multiproof, merkle_root)
+                print("\nVerification Result:", "VALID" if valid else "INVALID")
+                continue
+            idx = indices[0]
+            target = merkle_tree.leaf(idx)
+            proof = merkle_tree.proof(idx)
 
             print("\n=== MERKLE PROOF PATH (Sibling Hashes) ===")
             for i, (ph, direction) in enumerate(proof):
                 print(f"Step {i+1}: {ph} ({direction})")
 
-            valid = verify_proof(target, proof, merkle_root)
+            valid = verify_proof(target, proof, merkle_root, mode=merkle_tree.mode)
             print("\nVerification Result:", "VALID" if valid else "INVALID")
+            if os.path.exists("merkle_tree.idx"):
+                index = RecordIndex("merkle_tree.idx", PATH)
+                if idx < index.leaf_count:
+                    print("Proven record:")
+                    print_record(idx, index.record(idx))
+                index.close()
 
         elif choice == "8":
             print("\nRunning full performance analysis...")
-            hash_speed, hash_time = measure_hashing_speed(PATH)
-            leaf_hashes_perf = build_leaf_hashes(PATH)
-            root_perf, build_time, peak_mem = measure_merkle_build_performance(leaf_hashes_perf)
-            proof, proof_time = measure_proof_generation(leaf_hashes_perf, index=500)
-            performance_report(hash_speed, hash_time, build_time, peak_mem, proof_time)
+            METRICS.reset()
+            hash_speed, hash_time = measure_hashing_speed(PATH, mode=MODE)
+            canon_speed, _ = measure_canonicalization_speed(PATH)
+            leaf_start = time.time()
+            leaf_hashes_perf = build_leaf_hashes(PATH, packed=True, workers=None, mode=MODE)
+            phase_times = {"leaf hashing": time.time() - leaf_start}
+            tree_perf, build_time, peak_mem = measure_merkle_build_performance(leaf_hashes_perf, workers=None,
+                                                                                  mode=MODE)
+            phase_times.update(tree_perf.timings)
+            proof, proof_time = measure_proof_generation(tree_perf, index=500)
+            performance_report(hash_speed, hash_time, build_time, peak_mem, proof_time, phase_times,
+                               canon_speed)
+            METRICS.print_summary()
+            METRICS.dump("metrics.json")
+            METRICS.dump("metrics.prom")
+            print("Stage metrics written to metrics.json and metrics.prom")
 
         elif choice == "9":
             run_test_suite()
 
+        elif choice == "10":
+            if merkle_tree is None:
+                print("Build or load the tree first.")
+            else:
+                try:
+                    if record_offsets is None and os.path.exists("merkle_tree.idx"):
+                        index = RecordIndex("merkle_tree.idx")
+                        record_offsets = array.array("Q", (index.offset(i) for i in range(index.leaf_count)))
+                        index.close()
+#the appended tree must be consistent with the saved root, not just with itself
+                    append_to_tree(merkle_tree, PATH, offsets=record_offsets, old_root=load_root())
+                    merkle_root = merkle_tree.root
+                    save_root(merkle_root, mode=merkle_tree.mode)
+#no full-file checksum, so the append stays proportional to the new records
+                    save_tree(merkle_tree, source_path=PATH, checksum=False)
+                    if record_offsets is not None:
+                        save_offset_index(record_offsets, source_path=PATH)
+                except ValueError as exc:
+                    print(f"Cannot append: {exc}")
+
+        elif choice == "11":
+            if merkle_tree is None:
+                print("Build or load the tree first.")
+            elif not os.path.exists("merkle_tree.idx"):
+                print("Save the tree first; the audit reads records through merkle_tree.idx.")
+            else:
+                samples = int(input("Records to sample [1000]: ") or 1000)
+                seed = input("Seed [random]: ")
+                index = RecordIndex("merkle_tree.idx", PATH)
+                try:
+                    print_audit(sample_audit(merkle_tree, index, samples, int(seed) if seed else None,
+                                             root=load_root()))
+                except ValueError as exc:
+                    print(f"Cannot audit: {exc}")
+                index.close()
+
         elif choice == "0":
             print("Goodbye!")
             break
@@ -0,0 +1,115 @@
+import json
+import time
+
+#stages of the leaf pipeline, used for the records/sec figure
+PIPELINE_STAGES = ("file_read", "json_parse", "text_clean", "leaf_hash")
+
+
+#cheap stage timers and counters for the hot paths in main.py.
+#timings are recorded per batch or per call, never per node, so leaving
+#them on costs a couple of perf_counter calls per 10k records
+class Metrics:
+    def __init__(self):
+#stage -> [calls, seconds]
+        self.timers = {}
+        self.counters = {}
+        self.hooks = []
+        self.started = time.time()
+
+    def add_time(self, stage, seconds, calls=1):
+        entry = self.timers.get(stage)
+        if entry is None:
+            self.timers[stage] = [calls, seconds]
+        else:
+            entry[0] += calls
+            entry[1] += seconds
+        if self.hooks:
+            for hook in self.hooks:
+                hook("timer", stage, seconds)
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.hooks:
+            for hook in self.hooks:
+                hook("counter", name, value)
+
+#opt-in callback hook(kind, name, value) run on every timer or counter update
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def reset(self):
+        self.timers.clear()
+        self.counters.clear()
+        self.started = time.time()
+
+#plain data that can cross a process boundary and be merged back
+    def raw(self):
+        return {"timers": {k: list(v) for k, v in self.timers.items()}, "counters": dict(self.counters)}
+
+    def merge(self, raw):
+        for stage, (calls, seconds) in raw["timers"].items():
+            self.add_time(stage, seconds, calls)
+        for name, value in raw["counters"].items():
+            self.incr(name, value)
+
+    def snapshot(self):
+        pipeline_seconds = sum(self.timers.get(s, (0, 0.0))[1] for s in PIPELINE_STAGES)
+        records = self.counters.get("records", 0)
+        data_bytes = self.counters.get("bytes", 0)
+        return {
+            "stages": {stage: {"calls": calls, "seconds": seconds}
+                       for stage, (calls, seconds) in self.timers.items()},
+            "counters": dict(self.counters),
+            "pipeline_seconds": pipeline_seconds,
+            "records_per_sec": records / pipeline_seconds if pipeline_seconds else 0.0,
+            "mb_per_sec": data_bytes / (1024 * 1024) / pipeline_seconds if pipeline_seconds else 0.0,
+            "uptime_seconds": time.time() - self.started,
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix="merkle"):
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds_total Time spent in each pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        for stage, entry in snap["stages"].items():
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {entry["seconds"]:.9f}')
+        lines += [
+            f"# HELP {prefix}_stage_calls_total Timed calls or batches per stage.",
+            f"# TYPE {prefix}_stage_calls_total counter",
+        ]
+        for stage, entry in snap["stages"].items():
+            lines.append(f'{prefix}_stage_calls_total{{stage="{stage}"}} {entry["calls"]}')
+        for name, value in snap["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        lines.append(f"# TYPE {prefix}_records_per_second gauge")
+        lines.append(f"{prefix}_records_per_second {snap['records_per_sec']:.3f}")
+        return "\n".join(lines) + "\n"
+
+#write the metrics as JSON, or Prometheus text when the name ends in .prom
+    def dump(self, filename):
+        text = self.to_prometheus() if filename.endswith(".prom") else self.to_json()
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def print_summary(self):
+        snap = self.snapshot()
+        total = sum(entry["seconds"] for entry in snap["stages"].values()) or 1.0
+        print("\n        STAGE BREAKDOWN")
+        for stage, entry in sorted(snap["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            share = entry["seconds"] / total * 100
+            print(f"{stage:<18}{entry['seconds']:>10.3f} sec  {share:5.1f}%  ({entry['calls']:,} calls)")
+        print(f"Records:           {snap['counters'].get('records', 0):,}")
+        print(f"Bytes:             {snap['counters'].get('bytes', 0):,}")
+        print(f"Records/sec:       {snap['records_per_sec']:,.0f}")
+
+
+#process-wide registry used by main.py
+METRICS = Metrics()
@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import OrderedDict
+
+import main
+
+#upper layers with at most this many nodes are copied out of the mapping
+#and kept in memory; every proof touches them
+PIN_NODES = 1 << 16
+
+
+#one loaded tree version: the mapped tree, its file identity and a proof LRU
+class ServedTree:
+    def __init__(self, filename, pin_nodes=PIN_NODES, cache_size=100_000):
+        stat = os.stat(filename)
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.tree = main.load_tree(filename)
+        self.root = self.tree.root
+        self.pinned_levels = 0
+        for level in range(self.tree.height, -1, -1):
+            if self.tree.layer_size(level) > pin_nodes:
+                break
+            self.tree.layers[level] = bytes(self.tree.layers[level])
+            self.pinned_levels += 1
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.loaded_at = time.time()
+
+    def proof(self, index):
+        cached = self.cache.get(index)
+        if cached is not None:
+            self.cache.move_to_end(index)
+            return cached
+        response = {
+            "index": index,
+            "leaf": self.tree.leaf(index),
+            "proof": self.tree.proof(index),
+            "root": self.root,
+            "mode": self.tree.mode,
+        }
+        self.cache[index] = response
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return response
+
+
+class ProofServer:
+    def __init__(self, filename, pin_nodes=PIN_NODES, cache_size=100_000, poll_seconds=2.0):
+        self.filename = filename
+        self.pin_nodes = pin_nodes
+        self.cache_size = cache_size
+        self.poll_seconds = poll_seconds
+        self.served = ServedTree(filename, pin_nodes, cache_size)
+        self.requests = 0
+
+#load the new file fully, then swap the reference in one step; requests
+#already running keep the version they started with
+    async def reload(self):
+        loop = asyncio.get_running_loop()
+        served = await loop.run_in_executor(
+            None, ServedTree, self.filename, self.pin_nodes, self.cache_size
+        )
+        self.served = served
+        print(f"Reloaded tree: {served.tree.leaf_count:,} leaves, root {served.root}")
+        return served
+
+#save_tree publishes with os.replace, so a changed inode or mtime means a
+#complete new version is in place
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                stat = os.stat(self.filename)
+            except FileNotFoundError:
+                continue
+            if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self.served.identity:
+                try:
+                    await self.reload()
+                except (OSError, ValueError) as exc:
+                    print(f"Reload failed, still serving the previous tree: {exc}")
+
+    async def handle_request(self, request):
+        served = self.served
+        op = request.get("op")
+        if op == "root":
+            return {"root": served.root, "leaf_count": served.tree.leaf_count,
+                    "mode": served.tree.mode, "loaded_at": served.loaded_at}
+        if op == "proof":
+            index = int(request["index"])
+            return served.proof(index)
+        if op == "multiproof":
+            indices = [int(i) for i in request["indices"]]
+            multiproof = main.generate_multiproof(served.tree, indices)
+#[index, hash] pairs, since JSON would turn int dict keys into strings
+            multiproof["leaves"] = [[i, served.tree.leaf(i)] for i in indices]
+            multiproof["root"] = served.root
+            return multiproof
+        if op == "reload":
+            served = await self.reload()
+            return {"root": served.root, "leaf_count": served.tree.leaf_count}
+        if op == "stats":
+            return {"requests": self.requests, "cached_proofs": len(served.cache),
+                    "pinned_levels": served.pinned_levels, "leaf_count": served.tree.leaf_count}
+        raise ValueError(f"unknown op {op!r}")
+
+#newline-delimited JSON: one request object per line, one response per line
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.requests += 1
+                request = {}
+                try:
+                    request = json.loads(line)
+                    response = await self.handle_request(request)
+                except (ValueError, KeyError, TypeError, IndexError, AttributeError) as exc:
+                    response = {"error": str(exc)}
+                if isinstance(request, dict) and "id" in request:
+                    response = dict(response, id=request["id"])
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        watcher = asyncio.create_task(self.watch())
+        tree = self.served.tree
+        print(f"Serving {tree.leaf_count:,} leaves (root {self.served.root}) on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+#small blocking client for scripts and checks
+def query(request, host="127.0.0.1", port=8765, timeout=10.0):
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Merkle roots and proofs from a saved tree")
+    parser.add_argument("--tree", default="merkle_tree.bin")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pin-nodes", type=int, default=PIN_NODES,
+                        help="copy upper layers up to this many nodes into memory")
+    parser.add_argument("--cache-size", type=int, default=100_000, help="proofs kept in the LRU")
+    parser.add_argument("--poll", type=float, default=2.0, help="seconds between tree file checks")
+    args = parser.parse_args(argv)
+    server = ProofServer(args.tree, args.pin_nodes, args.cache_size, args.poll)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,142 +1,132 @@
 import streamlit as st
-import hashlib
-import json
+import os
 import networkx as nx
 import matplotlib.pyplot as plt
-import time
-
-def sha256_hash(text):
-    return hashlib.sha256(text.encode("utf-8")).hexdigest()
-
-def load_8_reviews(path):
-    leaf_hashes = []
-    ids = []
-    with open(path, "r", encoding="utf-8") as f:
-        for idx, line in enumerate(f):
-            if idx == 8:
-                break
-            data = json.loads(line)
-            rid = (
-                data.get("reviewID") or
-                data.get("reviewerID") or
-                data.get("id") or
-                str(idx)
-            )
-            asin = data.get("asin", "")
-            rating = str(data.get("overall", ""))
-            text = data.get("reviewText", "").strip()
-            combined = rid + "|" + asin + "|" + rating + "|" + text
-            leaf_hashes.append(sha256_hash(combined))
-            ids.append(rid)
-    return leaf_hashes, ids
-
-
-
-def build_merkle_tree(leaf_hashes):
-    G = nx.DiGraph()
-    layers = []
-    node_labels = {}
-
-    current = leaf_hashes[:]
-    layers.append(current)
-
-    while len(current) > 1:
-        next_layer = []
-        for i in range(0, len(current), 2):
-            parent = sha256_hash(current[i] + current[i+1])
-            next_layer.append(parent)
-        layers.append(next_layer)
-        current = next_layer
-
-   
-    for lvl, layer in enumerate(layers):
-        for i, h in enumerate(layer):
-            node_id = f"{lvl}_{i}"
-            G.add_node(node_id)
-            node_labels[node_id] = h
-
-   
-    for lvl in range(1, len(layers)):
-        for i in range(len(layers[lvl])):
-            parent = f"{lvl}_{i}"
-            left  = f"{lvl-1}_{2*i}"
-            right = f"{lvl-1}_{2*i+1}"
-            G.add_edge(parent, left)
-            G.add_edge(parent, right)
-
-    return G, layers, node_labels, layers[-1][0]
-
-
-def tree_layout(layers):
-    pos = {}
-    y_gap = 2
-    for level, layer in enumerate(layers):
-        count = len(layer)
-        x_spacing = 1.8
-        start_x = -(count - 1) / 2 * x_spacing
-        for i in range(count):
-            x = start_x + i * x_spacing
-            y = -level * y_gap
-            pos[f"{level}_{i}"] = (x, y)
-    return pos
-
-
-def draw_tree(G, pos, node_labels, highlight=None):
-    fig, ax = plt.subplots(figsize=(12, 6))
-    colors = []
-    for node in G.nodes():
-        if highlight and node in highlight:
-            colors.append("red")
-        else:
-            colors.append("skyblue")
-    nx.draw(G, pos, node_color=colors, node_size=1600, with_labels=False, ax=ax)
-    for node, (x, y) in pos.items():
-        short = node_labels[node][:6] + "..."
-        ax.text(x, y, short, ha="center", va="center", fontsize=8)
-    return fig
-
-def generate_proof(layers, index):
-    proof = []
-    idx = index
-    for lvl in range(len(layers)-1):
 
-        if idx % 2 == 0:
-            sibling = idx + 1
-        else:
-            sibling = idx - 1
+import main
 
-        proof.append((lvl, idx, sibling))
-        idx //= 2
+TREE_FILE = "merkle_tree.bin"
+INDEX_FILE = "merkle_tree.idx"
+DATASET = "Movies_and_TV_5.json"
+#leaves hashed for the demo tree when no saved tree file exists
+DEMO_LEAVES = 1024
 
-    return proof
 
+#the tree is mapped once and kept across reruns; the mtime in the key
+#makes a newly saved tree file load on the next rerun
+@st.cache_resource
+def load_saved_tree(filename, mtime_ns):
+    return main.load_tree(filename)
 
-def main():
-    st.title("Merkle Tree Visualization")
-    leaf_hashes, ids = load_8_reviews("Movies_and_TV_5.json")
-    G, layers, node_labels, root = build_merkle_tree(leaf_hashes)
-    pos = tree_layout(layers)
+@st.cache_resource
+def build_demo_tree(path, leaves):
+    return main.build_merkle_tree(main.build_leaf_hashes(path, limit=leaves, packed=True), verbose=False)
 
-    st.subheader("Merkle Tree for 8 reviews")
-    st.pyplot(draw_tree(G, pos, node_labels))
+def open_tree(filename):
+    if os.path.exists(filename):
+        return load_saved_tree(filename, os.stat(filename).st_mtime_ns), f"Saved tree {filename}"
+    if os.path.exists(DATASET):
+        return build_demo_tree(DATASET, DEMO_LEAVES), f"Demo tree over the first {DEMO_LEAVES:,} reviews"
+    return None, None
 
-    st.subheader("Generate Merkle Proof Path")
-    index = st.number_input("Select leaf index (0–7)", min_value=0, max_value=7, step=1)
 
-    if st.button("Show Animated Proof Path"):
-        proof = generate_proof(layers, index)
-        animated = []
-
-        for (lvl, idx, sibling) in proof:
+#nodes to draw: the leaf-to-root path plus `window` neighbours on each side
+#at every level. only these nodes are read from the tree
+def path_window(tree, index, window):
+    nodes = {}
+    path = []
+    idx = index
+    for level in range(tree.height + 1):
+        path.append((level, idx))
+        for i in range(max(0, idx - window), min(tree.layer_size(level), idx + window + 1)):
+            nodes[(level, i)] = tree.node(level, i).hex()
+        idx //= 2
+    return nodes, path
 
-            animated.append(f"{lvl}_{idx}")
+def build_graph(tree, nodes):
+    G = nx.DiGraph()
+    for level, i in nodes:
+        G.add_node((level, i))
+        if (level + 1, i // 2) in nodes and level < tree.height:
+            G.add_edge((level + 1, i // 2), (level, i))
+    return G
+
+#the path is a vertical line; neighbours sit either side of it, root on top
+def window_layout(nodes, path):
+    path_index = dict(path)
+    return {(level, i): (i - path_index[level], level) for level, i in nodes}
+
+def draw_window(tree, nodes, path, step):
+    G = build_graph(tree, nodes)
+    pos = window_layout(nodes, path)
+    shown = path[:step + 1]
+    siblings = set()
+    for level, idx in shown[:-1]:
+        if idx ^ 1 < tree.layer_size(level):
+            siblings.add((level, idx ^ 1))
+    colors = []
+    for node in G.nodes():
+        if node in shown:
+            colors.append("red")
+        elif node in siblings:
+            colors.append("orange")
+        else:
+            colors.append("skyblue")
+    width = max(x for x, _ in pos.values()) - min(x for x, _ in pos.values()) + 2
+    fig, ax = plt.subplots(figsize=(min(4 + width * 1.4, 16), 1 + 0.6 * (tree.height + 1)))
+    nx.draw(G, pos, node_color=colors, node_size=900, with_labels=False, ax=ax, arrows=False)
+    for node, (x, y) in pos.items():
+        ax.text(x, y, nodes[node][:6], ha="center", va="center", fontsize=7)
+    return fig
 
-            animated.append(f"{lvl}_{sibling}")
 
-            fig = draw_tree(G, pos, node_labels, highlight=animated)
-            st.pyplot(fig)
-            time.sleep(0.7)
+def main_page():
+    st.title("Merkle Tree Explorer")
+    filename = st.sidebar.text_input("Tree file", TREE_FILE)
+    tree, source = open_tree(filename)
+    if tree is None:
+        st.error(f"No tree file {filename} and no dataset {DATASET}. Build and save a tree first.")
+        return
+
+    st.caption(f"{source}: {tree.leaf_count:,} leaves, height {tree.height}, {tree.mode} mode")
+    st.code(f"Root: {tree.root}")
+
+    index = int(st.sidebar.number_input(
+        f"Leaf index (0-{tree.leaf_count - 1:,})", min_value=0, max_value=tree.leaf_count - 1, step=1
+    ))
+    window = st.sidebar.slider("Neighbours per side", min_value=0, max_value=4, value=2)
+    nodes, path = path_window(tree, index, window)
+
+#stepping through the proof redraws one small figure per rerun
+    step = tree.height
+    if tree.height:
+        step = st.slider("Proof step", min_value=0, max_value=tree.height, value=tree.height)
+    st.subheader(f"Path from leaf {index:,} to the root")
+    fig = draw_window(tree, nodes, path, step)
+    st.pyplot(fig)
+    plt.close(fig)
+
+    proof = tree.proof(index)
+    leaf = tree.leaf(index)
+    st.subheader("Merkle Proof")
+    st.table([
+        {"level": level, "node": idx, "side": side, "sibling": sibling[:16] + "..." if sibling else "-"}
+        for (level, idx), (sibling, side) in zip(path, proof)
+    ])
+    valid = main.compute_proof_root(leaf, proof, tree.mode).hex() == tree.root
+    st.write(f"Leaf: `{leaf}`")
+    st.write("Proof valid" if valid else "Proof INVALID")
+
+#the record the proof is about, read with one seek through the offset index
+    if os.path.exists(INDEX_FILE) and os.path.exists(DATASET):
+        record_index = main.RecordIndex(INDEX_FILE, DATASET)
+        if index < record_index.leaf_count:
+            st.subheader("Record")
+            if record_index.stale:
+                st.warning("The dataset changed since the record index was saved; this may be the wrong record.")
+            st.json(record_index.record(index))
+        record_index.close()
 
 
 if __name__ == "__main__":
-    main()
+    main_page()